@@ -5,11 +5,10 @@ import yaml
 import rospy
 import rospkg
 import numpy as np
-from cv_bridge import CvBridge
 from collections import deque
 from sensor_msgs.msg import Image
 from bitbots_msgs.msg import ColorSpace, Config
-from bitbots_vision.vision_modules import field_boundary, color, debug, evaluator
+from bitbots_vision.vision_modules import field_boundary, color, debug, evaluator, frame_mailbox, image_decoding
 
 class DynamicColorSpace:
     def __init__(self):
@@ -33,11 +32,12 @@ class DynamicColorSpace:
         rospy.init_node('bitbots_dynamic_color_space')
         rospy.loginfo('Initializing dynamic color-space...')
 
-        self.bridge = CvBridge()
-
         # Init params
         self.vision_config = {}
 
+        # The newest image is processed in the thread of the mailbox
+        self.image_mailbox = frame_mailbox.FrameMailbox(self.image_callback)
+
         # Subscribe to 'vision_config'-message
         # The message topic name MUST be the same as in the config publisher in vision.py
         self.sub_vision_config_msg = rospy.Subscriber(
@@ -122,7 +122,7 @@ class DynamicColorSpace:
             self.sub_image_msg = rospy.Subscriber(
                 vision_config['ROS_img_msg_topic'],
                 Image,
-                self.image_callback,
+                self.image_mailbox.put,
                 queue_size=vision_config['ROS_img_queue_size'],
                 tcp_nodelay=True,
                 buff_size=60000000)
@@ -133,11 +133,9 @@ class DynamicColorSpace:
     def image_callback(self, image_msg):
         # type: (Image) -> None
         """
-        This method is called by the Image-message subscriber.
-        Old Image-messages were dropped.
-
-        Sometimes the queue gets to large, even when the size is limeted to 1. 
-        That's, why we drop old images manually.
+        This method is called by the worker thread of the image mailbox with the newest Image-message.
+        Images arriving while an image is processed are replaced in the mailbox.
+        Images which are still too old are dropped.
 
         :param Image image_msg: new Image-message from Image-message subscriber
         :return: None
@@ -148,10 +146,13 @@ class DynamicColorSpace:
             return
 
         # Drops old images
-        image_age = rospy.get_rostime() - image_msg.header.stamp 
-        if image_age.to_sec() > 0.1:
+        statistics = self.image_mailbox.get_statistics()
+        if statistics['age'] > 0.1:
+            self.image_mailbox.reject()
             self.debug_printer.info('Dynamic color space: Dropped Image-message', 'image')
             return
+        self.debug_printer.info('Dynamic color space: image age {:.1f} ms, {} of {} images dropped, {} of them too old'.format(
+            statistics['age'] * 1000, statistics['dropped'], statistics['received'], statistics['rejected']), 'image')
 
         self.handle_image(image_msg)
 
@@ -165,7 +166,7 @@ class DynamicColorSpace:
         :return: None
         """
         # Converting the ROS image message to CV2-image
-        image = self.bridge.imgmsg_to_cv2(image_msg, 'bgr8')
+        image = image_decoding.imgmsg_to_bgr(image_msg)
         # Get new dynamic colors from image
         colors = self.get_new_dynamic_colors(image)
         # Add new colors to the queue
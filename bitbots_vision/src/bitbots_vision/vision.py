@@ -2,19 +2,20 @@
 
 import os
 import cv2
+import threading
 import yaml
 import rospy
 import rospkg
-import threading
 from cv_bridge import CvBridge
 from dynamic_reconfigure.server import Server
 from dynamic_reconfigure.encoding import Config as DynamicReconfigureConfig
-from sensor_msgs.msg import Image, JointState
+from sensor_msgs.msg import Image, CompressedImage, JointState
 from humanoid_league_msgs.msg import BallInImage, BallsInImage, LineInformationInImage, \
     LineSegmentInImage, ObstaclesInImage, ObstacleInImage, ImageWithRegionOfInterest, GoalPartsInImage, PostInImage, \
     GoalInImage, Speak
 from bitbots_vision.vision_modules import lines, field_boundary, color, debug, live_classifier, \
-    classifier, ball, fcnn_handler, live_fcnn_03, dummy_ballfinder, obstacle, evaluator, yolo_handler
+    classifier, ball, fcnn_handler, live_fcnn_03, dummy_ballfinder, obstacle, evaluator, yolo_handler, ball_tracker, \
+    frame_cache, scheduler, fcnn_process, fcnn_batcher, frame_mailbox, image_decoding, candidate
 from bitbots_vision.cfg import VisionConfig
 from bitbots_msgs.msg import Config
 
@@ -40,6 +41,17 @@ class Vision:
         # the head_joint_states is used by the dynamic field_boundary detector
         self.head_joint_state = None
 
+        # per-frame results shared by several modules, e.g. the yolo detections of the ball and goalpost detector
+        self.frame_cache = frame_cache.FrameCache()
+
+        # the newest image is processed in the thread of the mailbox
+        self.image_mailbox = frame_mailbox.FrameMailbox(self._image_callback)
+
+        # runs the stages of the per-frame pipeline, created in the dynamic reconfigure callback.
+        # The lock is held while a frame is processed, so the scheduler is not replaced during a frame.
+        self.frame_scheduler = None
+        self._frame_scheduler_lock = threading.Lock()
+
         self.debug_image_dings = debug.DebugImage()  # Todo: better variable name
         if self.debug_image_dings:
             self.runtime_evaluator = evaluator.RuntimeEvaluator(None)
@@ -65,17 +77,18 @@ class Vision:
     def _image_callback(self, image_msg):
         # type: (Image) -> None
         """
-        This method is called by the Image-message subscriber.
-        Old Image-messages were dropped.
-
-        Sometimes the queue gets to large, even when the size is limeted to 1. 
-        That's, why we drop old images manually.
+        This method is called by the worker thread of the image mailbox with the newest Image-message.
+        The Image-message subscriber only puts the messages into the mailbox,
+        so images arriving while an image is processed are replaced and never queue up.
+        Images which are still too old are dropped.
         """
-        # drops old images and cleans up queue
-        image_age = rospy.get_rostime() - image_msg.header.stamp 
-        if image_age.to_sec() > 1.0:
+        statistics = self.image_mailbox.get_statistics()
+        if statistics['age'] > 1.0:
+            self.image_mailbox.reject()
             self.debug_printer.info('Vision: Dropped Image-message', 'image')
             return
+        self.debug_printer.info('Vision: image age {:.1f} ms, {} of {} images dropped, {} of them too old'.format(
+            statistics['age'] * 1000, statistics['dropped'], statistics['received'], statistics['rejected']), 'image')
 
         self.handle_image(image_msg)
 
@@ -93,9 +106,30 @@ class Vision:
         speech_publisher.publish(speak_message)
 
     def handle_image(self, image_msg):
+        # the image is processed at the reduced resolution, the published coordinates are scaled back
+        self._image_scale = self.config['vision_image_reduction']
+        # the fcnn can get the image at the camera resolution
+        full_resolution_ball_image = self.config['vision_ball_classifier'] == 'fcnn' and \
+            self.config['ball_fcnn_full_resolution'] and self._image_scale > 1
+
         # converting the ROS image message to CV2-image
-        image = self.bridge.imgmsg_to_cv2(image_msg, 'bgr8')
+        if isinstance(image_msg, CompressedImage) and not full_resolution_ball_image:
+            # jpeg images are decoded directly at the reduced resolution
+            camera_image = None
+            image = image_decoding.compressed_imgmsg_to_bgr(image_msg, self._image_scale)
+        else:
+            if isinstance(image_msg, CompressedImage):
+                camera_image = image_decoding.compressed_imgmsg_to_bgr(image_msg)
+            else:
+                camera_image = image_decoding.imgmsg_to_bgr(image_msg)
+            image = self._reduce_image(camera_image)
 
+        if full_resolution_ball_image:
+            ball_image = camera_image
+            self._ball_image_scale = 1
+        else:
+            ball_image = image
+            self._ball_image_scale = self._image_scale
 
         if self._first_callback:
             mean = cv2.mean(image)
@@ -103,101 +137,228 @@ class Vision:
             if sum(mean) < self._blind_threshold:
                 self._speak("Hey!   Remove my camera cap!", self.speak_publisher)
 
+        # the color detectors classify yuv422 camera images directly, the neural networks and the debug image use bgr images.
+        # Images of other sources are classified as bgr images.
+        yuv_image = self.config['vision_yuv_color_detection'] and \
+            isinstance(image_msg, Image) and image_decoding.is_yuv422(image_msg)
+        color_image = image
+        if yuv_image:
+            color_image = self._reduce_image(image_decoding.imgmsg_to_yuv(image_msg))
+        for color_detector in [self.field_color_detector,
+                               self.white_color_detector,
+                               self.red_color_detector,
+                               self.blue_color_detector]:
+            color_detector.set_yuv_image(yuv_image)
+
         # setup detectors
-        self.field_boundary_detector.set_image(image)
-        self.obstacle_detector.set_image(image)
-        self.line_detector.set_image(image)
+        self.field_boundary_detector.set_image(color_image)
+        self.obstacle_detector.set_image(color_image)
+        self.line_detector.set_image(color_image)
 
         self.runtime_evaluator.set_image()
 
-        self.ball_detector.set_image(image)
+        # results shared by several modules are computed once per frame
+        self.frame_cache.set_frame(image_msg.header.stamp)
 
-        if self.config['vision_parallelize']:
-            self.field_boundary_detector.compute_all()  # computes stuff which is needed later in the processing
-            fcnn_thread = threading.Thread(target=self.ball_detector.compute_top_candidate)
-            conventional_thread = threading.Thread(target=self._conventional_precalculation())
+        self.ball_detector.set_image(ball_image, image_msg.header.stamp)
 
-            conventional_thread.start()
-            fcnn_thread.start()
+        # the stages of the pipeline work on this frame
+        self._image = image
+        self._image_msg = image_msg
+        with self._frame_scheduler_lock:
+            self.frame_scheduler.run()
+            self.debug_printer.info(self.frame_scheduler.get_timing_summary(), 'timing')
 
-            conventional_thread.join()
-            fcnn_thread.join()
-        else:
-            self.ball_detector.compute_top_candidate()
-            self._conventional_precalculation()
+        self._first_callback = False
+
+    def _reduce_image(self, image):
+        # type: (np.array) -> np.array
+        """
+        Reduces the resolution of a camera image to the resolution the image is processed at
+        :param image: image at the camera resolution
+        :return: image at the processed resolution
+        """
+        if self._image_scale == 1:
+            return image
+        return cv2.resize(
+            image,
+            (image.shape[1] // self._image_scale, image.shape[0] // self._image_scale),
+            interpolation=cv2.INTER_AREA)
+
+    def _to_camera_resolution(self, value, scale=None):
+        # type: (float, float) -> float
+        """
+        Maps a coordinate or size in the processed image to the resolution of the camera image
+        :param value: coordinate or size in pixels of the processed image
+        :param scale: size of the camera image relative to the processed image, default is the image reduction
+        :return: coordinate or size in pixels of the camera image
+        """
+        if scale is None:
+            scale = self._image_scale
+        return value * scale
 
+    def _ball_candidates_in_image(self, candidates):
+        # type: (list) -> list
+        """
+        Maps ball candidates from the image of the ball detector to the processed image, e.g. to draw them
+        :param candidates: list of Candidates (or None) in the image of the ball detector
+        :return: list of Candidates (or None) in the processed image
+        """
+        scale = self._ball_image_scale / float(self._image_scale)
+        if scale == 1:
+            return candidates
+        return [ball_candidate if ball_candidate is None else candidate.Candidate(
+            int(ball_candidate.get_upper_left_x() * scale),
+            int(ball_candidate.get_upper_left_y() * scale),
+            int(ball_candidate.get_width() * scale),
+            int(ball_candidate.get_height() * scale),
+            ball_candidate.rating) for ball_candidate in candidates]
+
+    def _config_changed(self, config, keys):
+        # type: (dict, list) -> bool
+        """
+        Returns whether one of the parameters changed, it is always true for the first configuration
+        :param config: the new configuration
+        :param keys: names of the parameters
+        :return: whether one of the parameters differs from the current configuration
+        """
+        return any(key not in self.config or self.config[key] != config[key] for key in keys)
+
+    def _create_frame_scheduler(self, worker_count):
+        # type: (int) -> scheduler.FrameScheduler
+        """
+        Declares the stages of the per-frame pipeline and their dependencies.
+        Independent stages run in parallel, when there are worker threads.
+
+        :param worker_count: number of worker threads, 0 runs the stages one after another
+        :return: the scheduler of the pipeline
+        """
+        frame_scheduler = scheduler.FrameScheduler(worker_count)
+        frame_scheduler.add_task('field_boundary', self._compute_field_boundary)
+        frame_scheduler.add_task('ball', self._compute_ball_candidates, ['field_boundary'])
+        frame_scheduler.add_task('obstacles', self._compute_obstacles, ['field_boundary'])
+        frame_scheduler.add_task('lines', self._compute_lines, ['field_boundary'])
+        frame_scheduler.add_task('ball_filtering', self._filter_ball_candidates, ['ball'])
+        frame_scheduler.add_task('line_segments', self._compute_line_segments, ['lines', 'ball_filtering'])
+        frame_scheduler.add_task('publish_balls', self._publish_balls, ['ball_filtering'])
+        frame_scheduler.add_task('publish_obstacles', self._publish_obstacles_and_goals, ['obstacles'])
+        frame_scheduler.add_task('publish_lines', self._publish_lines, ['line_segments'])
+        # the fcnn handler computes its results lazily, so it is only used by one stage at a time
+        frame_scheduler.add_task('publish_fcnn', self._publish_fcnn_output, ['ball_filtering'])
+        frame_scheduler.add_task('publish_debug_image', self._publish_debug_image,
+                                 ['ball_filtering', 'obstacles', 'line_segments'])
+        return frame_scheduler
+
+    def _compute_field_boundary(self):
+        # computes stuff which is needed later in the processing
+        self.field_boundary_detector.compute_all()
+
+    def _compute_ball_candidates(self):
+        self.ball_detector.compute_top_candidate()
+
+    def _compute_obstacles(self):
+        self.obstacle_detector.compute_all_obstacles()
+
+    def _compute_lines(self):
+        # line segments are computed after the ball filtering, they need the ball candidates
+        if self.config['line_detector_segment_method'] == 'points':
+            self.line_detector.compute_linepoints()
+
+    def _compute_line_segments(self):
+        # the line segments are computed once, before they are published and drawn
+        if self.config['line_detector_segment_method'] != 'points':
+            # balls must not be reported as lines
+            self.line_detector.set_candidates(self._ball_candidates or list())
+            self.line_detector.compute_linesegments()
+
+    def _filter_ball_candidates(self):
         # TODO: handle all ball candidates
 
         #"""
-        ball_candidates = self.ball_detector.get_candidates()
-
-        if ball_candidates:
-            balls_under_field_boundary = self.field_boundary_detector.balls_under_convex_field_boundary(ball_candidates)
+        self._ball_candidates = self.ball_detector.get_candidates()
+
+        if self._ball_candidates:
+            # in the pipelined mode of the fcnn, the candidates belong to the previous image and its field boundary
+            field_boundary = None
+            if hasattr(self.ball_detector, 'get_image_field_boundary'):
+                field_boundary = self.ball_detector.get_image_field_boundary()
+            balls_under_field_boundary = self.field_boundary_detector.balls_under_convex_field_boundary(
+                self._ball_candidates,
+                scale=self._ball_image_scale / float(self._image_scale),
+                field_boundary=field_boundary)
             if balls_under_field_boundary:
                 sorted_rated_candidates = sorted(balls_under_field_boundary, key=lambda x: x.rating)
-                top_ball_candidate = list([max(sorted_rated_candidates[0:1], key=lambda x: x.rating)])[0]
+                self._top_ball_candidate = list([max(sorted_rated_candidates[0:1], key=lambda x: x.rating)])[0]
             else:
-                top_ball_candidate = None
+                self._top_ball_candidate = None
         else:
-            top_ball_candidate = None
+            self._top_ball_candidate = None
         """
         # check whether ball candidates are under the field_boundary
         # TODO: handle multiple ball candidates
-        top_ball_candidate = self.ball_detector.get_top_candidate()
-        if top_ball_candidate:
+        self._top_ball_candidate = self.ball_detector.get_top_candidate()
+        if self._top_ball_candidate:
             ball = []
-            ball.append(top_ball_candidate)
+            ball.append(self._top_ball_candidate)
             ball_under_field_boundary = self.field_boundary_detector.balls_under_field_boundary(ball)
             if ball_under_field_boundary:
-                top_ball_candidate = ball_under_field_boundary[0]
+                self._top_ball_candidate = ball_under_field_boundary[0]
             else:
-                top_ball_candidate = None
+                self._top_ball_candidate = None
         #"""
 
+    def _publish_balls(self):
         # check whether ball candidates are over rating threshold
-        if top_ball_candidate and top_ball_candidate.rating > self._ball_candidate_threshold:
+        if self._top_ball_candidate and self._top_ball_candidate.rating > self._ball_candidate_threshold:
             # create ball msg
             # TODO: publish empty msg if no top candidate as described in msg description
             balls_msg = BallsInImage()
-            balls_msg.header.frame_id = image_msg.header.frame_id
-            balls_msg.header.stamp = image_msg.header.stamp
+            balls_msg.header.frame_id = self._image_msg.header.frame_id
+            balls_msg.header.stamp = self._image_msg.header.stamp
+            if self.config['vision_ball_classifier'] == 'fcnn':
+                # in the pipelined mode, the ball candidates belong to the previous image
+                balls_msg.header.stamp = self.ball_detector.get_image_stamp()
 
             ball_msg = BallInImage()
-            ball_msg.center.x = top_ball_candidate.get_center_x()
-            ball_msg.center.y = top_ball_candidate.get_center_y()
-            ball_msg.diameter = top_ball_candidate.get_diameter()
+            ball_msg.center.x = self._to_camera_resolution(
+                self._top_ball_candidate.get_center_x(), self._ball_image_scale)
+            ball_msg.center.y = self._to_camera_resolution(
+                self._top_ball_candidate.get_center_y(), self._ball_image_scale)
+            ball_msg.diameter = self._to_camera_resolution(
+                self._top_ball_candidate.get_diameter(), self._ball_image_scale)
             ball_msg.confidence = 1
 
             balls_msg.candidates.append(ball_msg)
             self.debug_printer.info('found a ball! \o/', 'ball')
             self.pub_balls.publish(balls_msg)
 
+    def _publish_obstacles_and_goals(self):
         # create goalpost msg
         goal_parts_msg = GoalPartsInImage()
-        goal_parts_msg.header.frame_id = image_msg.header.frame_id
-        goal_parts_msg.header.stamp = image_msg.header.stamp
+        goal_parts_msg.header.frame_id = self._image_msg.header.frame_id
+        goal_parts_msg.header.stamp = self._image_msg.header.stamp
 
         # create obstacle msg
         obstacles_msg = ObstaclesInImage()
-        obstacles_msg.header.frame_id = image_msg.header.frame_id
-        obstacles_msg.header.stamp = image_msg.header.stamp
+        obstacles_msg.header.frame_id = self._image_msg.header.frame_id
+        obstacles_msg.header.stamp = self._image_msg.header.stamp
         for red_obs in self.obstacle_detector.get_red_obstacles():
             obstacle_msg = ObstacleInImage()
             obstacle_msg.color = ObstacleInImage.ROBOT_MAGENTA
-            obstacle_msg.top_left.x = red_obs.get_upper_left_x()
-            obstacle_msg.top_left.y = red_obs.get_upper_left_y()
-            obstacle_msg.height = int(red_obs.get_height())
-            obstacle_msg.width = int(red_obs.get_width())
+            obstacle_msg.top_left.x = self._to_camera_resolution(red_obs.get_upper_left_x())
+            obstacle_msg.top_left.y = self._to_camera_resolution(red_obs.get_upper_left_y())
+            obstacle_msg.height = int(self._to_camera_resolution(red_obs.get_height()))
+            obstacle_msg.width = int(self._to_camera_resolution(red_obs.get_width()))
             obstacle_msg.confidence = 1.0
             obstacle_msg.playerNumber = 42
             obstacles_msg.obstacles.append(obstacle_msg)
         for blue_obs in self.obstacle_detector.get_blue_obstacles():
             obstacle_msg = ObstacleInImage()
             obstacle_msg.color = ObstacleInImage.ROBOT_CYAN
-            obstacle_msg.top_left.x = blue_obs.get_upper_left_x()
-            obstacle_msg.top_left.y = blue_obs.get_upper_left_y()
-            obstacle_msg.height = int(blue_obs.get_height())
-            obstacle_msg.width = int(blue_obs.get_width())
+            obstacle_msg.top_left.x = self._to_camera_resolution(blue_obs.get_upper_left_x())
+            obstacle_msg.top_left.y = self._to_camera_resolution(blue_obs.get_upper_left_y())
+            obstacle_msg.height = int(self._to_camera_resolution(blue_obs.get_height()))
+            obstacle_msg.width = int(self._to_camera_resolution(blue_obs.get_width()))
             obstacle_msg.confidence = 1.0
             obstacle_msg.playerNumber = 42
             obstacles_msg.obstacles.append(obstacle_msg)
@@ -206,28 +367,28 @@ class Vision:
             candidates = self.goalpost_detector.get_candidates()
             for goalpost in candidates:
                 post_msg = PostInImage()
-                post_msg.width = goalpost.get_width()
+                post_msg.width = self._to_camera_resolution(goalpost.get_width())
                 post_msg.confidence = goalpost.get_rating()
-                post_msg.foot_point.x = goalpost.get_center_x()
-                post_msg.foot_point.y = goalpost.get_lower_right_y()
+                post_msg.foot_point.x = self._to_camera_resolution(goalpost.get_center_x())
+                post_msg.foot_point.y = self._to_camera_resolution(goalpost.get_lower_right_y())
                 post_msg.top_point = post_msg.foot_point
                 goal_parts_msg.posts.append(post_msg)
         else:
             for white_obs in self.obstacle_detector.get_white_obstacles():
                 post_msg = PostInImage()
-                post_msg.width = white_obs.get_width()
+                post_msg.width = self._to_camera_resolution(white_obs.get_width())
                 post_msg.confidence = 1.0
-                post_msg.foot_point.x = white_obs.get_center_x()
-                post_msg.foot_point.y = white_obs.get_lower_right_y()
+                post_msg.foot_point.x = self._to_camera_resolution(white_obs.get_center_x())
+                post_msg.foot_point.y = self._to_camera_resolution(white_obs.get_lower_right_y())
                 post_msg.top_point = post_msg.foot_point
                 goal_parts_msg.posts.append(post_msg)
         for other_obs in self.obstacle_detector.get_other_obstacles():
             obstacle_msg = ObstacleInImage()
             obstacle_msg.color = ObstacleInImage.UNDEFINED
-            obstacle_msg.top_left.x = other_obs.get_upper_left_x()
-            obstacle_msg.top_left.y = other_obs.get_upper_left_y()
-            obstacle_msg.height = int(other_obs.get_height())
-            obstacle_msg.width = int(other_obs.get_width())
+            obstacle_msg.top_left.x = self._to_camera_resolution(other_obs.get_upper_left_x())
+            obstacle_msg.top_left.y = self._to_camera_resolution(other_obs.get_upper_left_y())
+            obstacle_msg.height = int(self._to_camera_resolution(other_obs.get_height()))
+            obstacle_msg.width = int(self._to_camera_resolution(other_obs.get_width()))
             obstacle_msg.confidence = 1.0
             obstacles_msg.obstacles.append(obstacle_msg)
         self.pub_obstacle.publish(obstacles_msg)
@@ -253,22 +414,32 @@ class Vision:
         if goal_parts_msg.posts:
             self.pub_goal.publish(goal_msg)
 
+    def _publish_lines(self):
         # create line msg
         line_msg = LineInformationInImage()  # Todo: add lines
-        line_msg.header.frame_id = image_msg.header.frame_id
-        line_msg.header.stamp = image_msg.header.stamp
-        for lp in self.line_detector.get_linepoints():
-            ls = LineSegmentInImage()
-            ls.start.x = lp[0]
-            ls.start.y = lp[1]
-            ls.end = ls.start
-            line_msg.segments.append(ls)
+        line_msg.header.frame_id = self._image_msg.header.frame_id
+        line_msg.header.stamp = self._image_msg.header.stamp
+        if self.config['line_detector_segment_method'] == 'points':
+            for lp in self.line_detector.get_linepoints():
+                ls = LineSegmentInImage()
+                ls.start.x = self._to_camera_resolution(lp[0])
+                ls.start.y = self._to_camera_resolution(lp[1])
+                ls.end = ls.start
+                line_msg.segments.append(ls)
+        else:
+            for segment in self.line_detector.get_linesegments():
+                ls = LineSegmentInImage()
+                ls.start.x = self._to_camera_resolution(segment[0])
+                ls.start.y = self._to_camera_resolution(segment[1])
+                ls.end.x = self._to_camera_resolution(segment[2])
+                ls.end.y = self._to_camera_resolution(segment[3])
+                line_msg.segments.append(ls)
         self.pub_lines.publish(line_msg)
 
         # create non_line msg
         # non_line_msg = LineInformationInImage()
-        # non_line_msg.header.frame_id = image_msg.header.frame_id
-        # non_line_msg.header.stamp = image_msg.header.stamp
+        # non_line_msg.header.frame_id = self._image_msg.header.frame_id
+        # non_line_msg.header.stamp = self._image_msg.header.stamp
         # i = 0
         # for nlp in self.line_detector.get_nonlinepoints():
         #     nls = LineSegmentInImage()
@@ -280,15 +451,27 @@ class Vision:
         #     i += 1
         # self.pub_non_lines.publish(non_line_msg)
 
+    def _publish_fcnn_output(self):
         if self.ball_fcnn_publish_output and self.config['vision_ball_classifier'] == 'fcnn':
-            self.pub_ball_fcnn.publish(self.ball_detector.get_cropped_msg())
+            fcnn_msg = self.ball_detector.get_cropped_msg()
+            if fcnn_msg is not None:
+                # the region of interest refers to the camera image, the image itself keeps the processed resolution
+                region = fcnn_msg.regionOfInterest
+                region.x_offset = int(self._to_camera_resolution(region.x_offset, self._ball_image_scale))
+                region.y_offset = int(self._to_camera_resolution(region.y_offset, self._ball_image_scale))
+                region.height = int(self._to_camera_resolution(region.height, self._ball_image_scale))
+                region.width = int(self._to_camera_resolution(region.width, self._ball_image_scale))
+                self.pub_ball_fcnn.publish(fcnn_msg)
 
         if self.publish_fcnn_debug_image and self.config['vision_ball_classifier'] == 'fcnn':
-            self.pub_debug_fcnn_image.publish(self.ball_detector.get_debug_image())
+            fcnn_debug_image = self.ball_detector.get_debug_image()
+            if fcnn_debug_image is not None:
+                self.pub_debug_fcnn_image.publish(fcnn_debug_image)
 
+    def _publish_debug_image(self):
         # do debug stuff
         if self.publish_debug_image:
-            self.debug_image_dings.set_image(image)
+            self.debug_image_dings.set_image(self._image)
             self.debug_image_dings.draw_obstacle_candidates(
                 self.obstacle_detector.get_candidates(),
                 (0, 0, 0),
@@ -319,21 +502,28 @@ class Vision:
             self.debug_image_dings.draw_field_boundary(
                 self.field_boundary_detector.get_convex_field_boundary_points(),
                 (0, 255, 255))
+            ball_candidates = self._ball_candidates_in_image(self.ball_detector.get_candidates())
             self.debug_image_dings.draw_ball_candidates(
-                self.ball_detector.get_candidates(),
+                ball_candidates,
                 (0, 0, 255))
             self.debug_image_dings.draw_ball_candidates(
                 self.field_boundary_detector.balls_under_field_boundary(
-                    self.ball_detector.get_candidates(),
+                    ball_candidates,
                     self._ball_candidate_y_offset),
                 (0, 255, 255))
             # draw top candidate in
-            self.debug_image_dings.draw_ball_candidates([top_ball_candidate],
+            self.debug_image_dings.draw_ball_candidates(self._ball_candidates_in_image([self._top_ball_candidate]),
                                                         (0, 255, 0))
-            # draw linepoints in red
-            self.debug_image_dings.draw_points(
-                self.line_detector.get_linepoints(),
-                (0, 0, 255))
+            if self.config['line_detector_segment_method'] == 'points':
+                # draw linepoints in red
+                self.debug_image_dings.draw_points(
+                    self.line_detector.get_linepoints(),
+                    (0, 0, 255))
+            else:
+                # draw line segments in red
+                self.debug_image_dings.draw_line_segments(
+                    self.line_detector.get_linesegments(),
+                    (0, 0, 255))
             # draw nonlinepoints in black
             # self.debug_image_dings.draw_points(
             #     self.line_detector.get_nonlinepoints(),
@@ -342,18 +532,15 @@ class Vision:
             # publish debug image
             self.pub_debug_image.publish(self.bridge.cv2_to_imgmsg(self.debug_image_dings.get_image(), 'bgr8'))
 
-        self._first_callback = False
-
-    def _conventional_precalculation(self):
-        self.obstacle_detector.compute_all_obstacles()
-        self.line_detector.compute_linepoints()
-
     def _dynamic_reconfigure_callback(self, config, level):
         #rospy.logerr("in dynamic re callback")
-        self.debug_printer = debug.DebugPrinter(
-            debug_classes=debug.DebugPrinter.generate_debug_class_list_from_string(
-                config['vision_debug_printer_classes']))
-        self.runtime_evaluator = evaluator.RuntimeEvaluator(self.debug_printer)
+        # the modules are updated in place, so only the modules affected by the changed parameters are rebuilt
+        debug_classes = debug.DebugPrinter.generate_debug_class_list_from_string(config['vision_debug_printer_classes'])
+        if 'vision_debug_printer_classes' not in self.config:
+            self.debug_printer = debug.DebugPrinter(debug_classes=debug_classes)
+            self.runtime_evaluator = evaluator.RuntimeEvaluator(self.debug_printer)
+        elif self._config_changed(config, ['vision_debug_printer_classes']):
+            self.debug_printer.set_debug_classes(debug_classes)
 
         self._blind_threshold = config['vision_blind_threshold']
         self._ball_candidate_threshold = config['vision_ball_candidate_rating_threshold']
@@ -372,9 +559,6 @@ class Vision:
 
         self.publish_fcnn_debug_image = config['ball_fcnn_publish_debug_img']
 
-        if config['vision_ball_classifier'] == 'dummy':
-            self.ball_detector = dummy_ballfinder.DummyClassifier(None, None, self.debug_printer)
-
         # Print status of color config
         if 'vision_use_sim_color' not in self.config or \
             config['vision_use_sim_color'] != self.config['vision_use_sim_color']:
@@ -383,61 +567,77 @@ class Vision:
             else:
                 rospy.loginfo('Loaded color space for REAL WORLD.')
 
-        self.white_color_detector = color.HsvSpaceColorDetector(
-            self.debug_printer,
-            [config['white_color_detector_lower_values_h'], config['white_color_detector_lower_values_s'],
-             config['white_color_detector_lower_values_v']],
-            [config['white_color_detector_upper_values_h'], config['white_color_detector_upper_values_s'],
-             config['white_color_detector_upper_values_v']])
-
-        self.red_color_detector = color.HsvSpaceColorDetector(
-            self.debug_printer,
-            [config['red_color_detector_lower_values_h'], config['red_color_detector_lower_values_s'],
-             config['red_color_detector_lower_values_v']],
-            [config['red_color_detector_upper_values_h'], config['red_color_detector_upper_values_s'],
-             config['red_color_detector_upper_values_v']])
-
-        self.blue_color_detector = color.HsvSpaceColorDetector(
-            self.debug_printer,
-            [config['blue_color_detector_lower_values_h'], config['blue_color_detector_lower_values_s'],
-             config['blue_color_detector_lower_values_v']],
-            [config['blue_color_detector_upper_values_h'], config['blue_color_detector_upper_values_s'],
-             config['blue_color_detector_upper_values_v']])
-
-        if config['dynamic_color_space_active']:
-            self.field_color_detector = color.DynamicPixelListColorDetector(
+        # the lookup tables of all color detectors depend on the input color space
+        color_detectors_changed = self._config_changed(config, ['vision_yuv_color_detection'])
+        for name in ['white', 'red', 'blue']:
+            min_vals = [config['{}_color_detector_lower_values_{}'.format(name, channel)] for channel in 'hsv']
+            max_vals = [config['{}_color_detector_upper_values_{}'.format(name, channel)] for channel in 'hsv']
+            detector_name = '{}_color_detector'.format(name)
+            if color_detectors_changed:
+                setattr(self, detector_name, color.HsvSpaceColorDetector(
+                    self.debug_printer,
+                    min_vals,
+                    max_vals,
+                    yuv_input=config['vision_yuv_color_detection']))
+            elif self._config_changed(config, ['{}_color_detector_{}_values_{}'.format(name, bound, channel)
+                                               for bound in ['lower', 'upper'] for channel in 'hsv']):
+                getattr(self, detector_name).set_config(min_vals, max_vals)
+
+        # loading a color space takes a while, it is only reloaded when it changed
+        if color_detectors_changed or self._config_changed(config, [
+                'dynamic_color_space_active',
+                'vision_use_sim_color',
+                'field_color_detector_path',
+                'field_color_detector_path_sim',
+                'ROS_field_mask_image_msg_topic',
+                'ROS_dynamic_color_space_msg_topic',
+                'ROS_dynamic_color_space_field_mask_image_msg_topic']):
+            color_detectors_changed = True
+            if config['dynamic_color_space_active']:
+                self.field_color_detector = color.DynamicPixelListColorDetector(
+                    self.debug_printer,
+                    self.package_path,
+                    config,
+                    primary_detector=True,
+                    yuv_input=config['vision_yuv_color_detection'])
+            else:
+                self.field_color_detector = color.PixelListColorDetector(
+                    self.debug_printer,
+                    self.package_path,
+                    config,
+                    yuv_input=config['vision_yuv_color_detection'])
+        else:
+            self.field_color_detector.set_config(config)
+
+        # the detectors keep their state (e.g. the head joint state of the field boundary detector),
+        # they are only rebuilt together with their color detectors
+        if color_detectors_changed:
+            self.field_boundary_detector = field_boundary.FieldBoundaryDetector(
+                self.field_color_detector,
+                config,
                 self.debug_printer,
-                self.package_path,
+                self.runtime_evaluator)
+
+            self.line_detector = lines.LineDetector(
+                self.white_color_detector,
+                self.field_color_detector,
+                self.field_boundary_detector,
+                config,
+                self.debug_printer)
+
+            self.obstacle_detector = obstacle.ObstacleDetector(
+                self.red_color_detector,
+                self.blue_color_detector,
+                self.white_color_detector,
+                self.field_boundary_detector,
+                self.runtime_evaluator,
                 config,
-                primary_detector=True)
+                self.debug_printer
+            )
         else:
-            self.field_color_detector = color.PixelListColorDetector(
-                self.debug_printer,
-                self.package_path,
-                config)
-
-        self.field_boundary_detector = field_boundary.FieldBoundaryDetector(
-            self.field_color_detector,
-            config,
-            self.debug_printer,
-            self.runtime_evaluator)
-
-        self.line_detector = lines.LineDetector(
-            self.white_color_detector,
-            self.field_color_detector,
-            self.field_boundary_detector,
-            config,
-            self.debug_printer)
-
-        self.obstacle_detector = obstacle.ObstacleDetector(
-            self.red_color_detector,
-            self.blue_color_detector,
-            self.white_color_detector,
-            self.field_boundary_detector,
-            self.runtime_evaluator,
-            config,
-            self.debug_printer
-        )
+            self.field_boundary_detector.set_config(config)
+            self.line_detector.set_config(config)
+            self.obstacle_detector.set_config(config)
 
         # set up ball config for fcnn
         # these config params have domain-specific names which could be problematic for fcnn handlers handling e.g. goal candidates
@@ -452,25 +652,94 @@ class Vision:
             'max_candidate_diameter': config['ball_fcnn_max_ball_diameter'],
             'candidate_refinement_iteration_count': config['ball_fcnn_candidate_refinement_iteration_count'],
             'publish_field_boundary_offset': config['ball_fcnn_publish_field_boundary_offset'],
+            'crop_to_field_boundary': config['ball_fcnn_crop_to_field_boundary'],
+            'crop_margin': config['ball_fcnn_crop_margin'],
+            'crop_scale': config['ball_fcnn_crop_scale'],
+            'candidate_method': config['ball_fcnn_candidate_method'],
+            'pipelined': config['ball_fcnn_pipelined'],
+            # the field boundary is computed on the reduced image
+            'field_boundary_scale': config['vision_image_reduction'] if config['ball_fcnn_full_resolution'] else 1,
+        }
+
+        # threading options of the tensorflow sessions, see tf_session.create_session
+        self.neural_network_session_options = {
+            'intra_op_threads': config['neural_network_intra_op_threads'],
+            'inter_op_threads': config['neural_network_inter_op_threads'],
+            'cpu_affinity': config['neural_network_cpu_affinity'],
+            'use_per_session_threads': config['neural_network_use_per_session_threads'],
         }
 
+        # the worker process of the fcnn and the batching thread are stopped, when the fcnn is not used anymore
+        if config['vision_ball_classifier'] != 'fcnn':
+            if getattr(self, 'ball_fcnn_batcher', None) is not None:
+                self.ball_fcnn_batcher.shutdown()
+                self.ball_fcnn_batcher = None
+            if isinstance(getattr(self, 'ball_fcnn', None), fcnn_process.FcnnProcess):
+                self.ball_fcnn.shutdown()
+                self.ball_fcnn = None
+
+        # the ball detector and its tracker keep their state (e.g. the pipelined frame of the fcnn and the track),
+        # they are only rebuilt when the model, the classifier or the field boundary detector changes
+        ball_detector = getattr(self, 'ball_detector', None)
+        if isinstance(ball_detector, ball_tracker.BallTracker):
+            ball_detector = ball_detector.get_detector()
+
+        if config['vision_ball_classifier'] == 'dummy':
+            if not isinstance(ball_detector, dummy_ballfinder.DummyClassifier):
+                ball_detector = dummy_ballfinder.DummyClassifier(None, None, self.debug_printer)
+
         # load fcnn
         if config['vision_ball_classifier'] == 'fcnn':
-            if 'neural_network_model_path' not in self.config or \
+            fcnn_changed = 'neural_network_model_path' not in self.config or \
                     self.config['neural_network_model_path'] != config['neural_network_model_path'] or \
-                    self.config['vision_ball_classifier'] != config['vision_ball_classifier']:
+                    self.config['vision_ball_classifier'] != config['vision_ball_classifier'] or \
+                    self.config['ball_fcnn_backend'] != config['ball_fcnn_backend'] or \
+                    self.config['ball_fcnn_process'] != config['ball_fcnn_process'] or \
+                    any(self.config[key] != config[key] for key in [
+                        'neural_network_intra_op_threads',
+                        'neural_network_inter_op_threads',
+                        'neural_network_cpu_affinity',
+                        'neural_network_use_per_session_threads'])
+            # the batcher is stopped before the fcnn it runs on is replaced
+            batcher_changed = fcnn_changed or self.config['ball_fcnn_batch_size'] != config['ball_fcnn_batch_size']
+            if batcher_changed:
+                if getattr(self, 'ball_fcnn_batcher', None) is not None:
+                    self.ball_fcnn_batcher.shutdown()
+                self.ball_fcnn_batcher = None
+            if fcnn_changed:
                 ball_fcnn_path = os.path.join(self.package_path, 'models', config['neural_network_model_path'])
                 if not os.path.exists(ball_fcnn_path):
                     rospy.logerr('AAAAHHHH! The specified fcnn model file doesn\'t exist!')
-                self.ball_fcnn = live_fcnn_03.FCNN03(ball_fcnn_path, self.debug_printer)
+                if isinstance(getattr(self, 'ball_fcnn', None), fcnn_process.FcnnProcess):
+                    self.ball_fcnn.shutdown()
+                if config['ball_fcnn_process']:
+                    self.ball_fcnn = fcnn_process.FcnnProcess(
+                        config['ball_fcnn_backend'],
+                        ball_fcnn_path,
+                        self.debug_printer,
+                        self.neural_network_session_options)
+                else:
+                    self.ball_fcnn = live_fcnn_03.load_fcnn(
+                        config['ball_fcnn_backend'],
+                        ball_fcnn_path,
+                        self.debug_printer,
+                        self.neural_network_session_options)
                 rospy.loginfo(config['vision_ball_classifier'] + " vision is running now")
-            self.ball_detector = fcnn_handler.FcnnHandler(
-                self.ball_fcnn,
-                self.field_boundary_detector,
-                self.ball_fcnn_config,
-                self.debug_printer)
+            if batcher_changed and config['ball_fcnn_batch_size'] > 0:
+                # without a waiting time, a batch contains the images which queued up during the previous batch
+                self.ball_fcnn_batcher = fcnn_batcher.FcnnBatcher(
+                    self.ball_fcnn,
+                    max_batch_size=config['ball_fcnn_batch_size'],
+                    max_wait=0)
+            if batcher_changed or color_detectors_changed or not isinstance(ball_detector, fcnn_handler.FcnnHandler):
+                ball_detector = fcnn_handler.FcnnHandler(
+                    self.ball_fcnn_batcher or self.ball_fcnn,
+                    self.field_boundary_detector,
+                    self.ball_fcnn_config,
+                    self.debug_printer)
+            else:
+                ball_detector.set_config(self.ball_fcnn_config)
 
-        
         if config['vision_ball_classifier'] == 'yolo':
             if 'neural_network_model_path' not in self.config or \
                     self.config['neural_network_model_path'] != config['neural_network_model_path'] or \
@@ -479,11 +748,30 @@ class Vision:
                 if not os.path.exists(yolo_model_path):
                     rospy.logerr('AAAAHHHH! The specified yolo model file doesn\'t exist!')
                 # TODO replace following strings with path to config/weights
-                yolo = yolo_handler.YoloHandler(config, yolo_model_path)
-                self.ball_detector = yolo_handler.YoloBallDetector(yolo)
-                self.goalpost_detector = yolo_handler.YoloGoalpostDetector(yolo)
+                self.yolo = yolo_handler.YoloHandler(config, yolo_model_path, self.frame_cache)
+                ball_detector = yolo_handler.YoloBallDetector(self.yolo)
+                self.goalpost_detector = yolo_handler.YoloGoalpostDetector(self.yolo)
                 rospy.loginfo(config['vision_ball_classifier'] + " vision is running now")
-         
+            self.yolo.set_config(config, self.field_boundary_detector)
+
+        if config['vision_ball_tracking']:
+            ball_tracker_config = {
+                'full_frame_interval': config['vision_ball_tracking_full_frame_interval'],
+                'window_factor': config['vision_ball_tracking_window_factor'],
+                'min_window_size': config['vision_ball_tracking_min_window_size'],
+                'alpha': config['vision_ball_tracking_alpha'],
+                'beta': config['vision_ball_tracking_beta'],
+            }
+            # the track is kept as long as the tracked detector is kept
+            current_ball_detector = getattr(self, 'ball_detector', None)
+            if isinstance(current_ball_detector, ball_tracker.BallTracker) and \
+                    current_ball_detector.get_detector() is ball_detector:
+                self.ball_detector.set_config(ball_tracker_config)
+            else:
+                self.ball_detector = ball_tracker.BallTracker(ball_detector, ball_tracker_config, self.debug_printer)
+        else:
+            self.ball_detector = ball_detector
+
         # publishers
 
         # TODO: topic: ball_in_... BUT MSG TYPE: balls_in_img... CHANGE TOPIC TYPE!
@@ -560,15 +848,29 @@ class Vision:
                 Image,
                 queue_size=1)
 
+        if 'vision_parallelize' not in self.config or \
+                config['vision_parallelize'] != self.config['vision_parallelize'] or \
+                config['vision_worker_threads'] != self.config['vision_worker_threads']:
+            # without parallelization, the stages run one after another in the image callback
+            worker_count = config['vision_worker_threads'] if config['vision_parallelize'] else 0
+            frame_scheduler = self._create_frame_scheduler(worker_count)
+            # the old scheduler is shut down after the frame it is currently running
+            with self._frame_scheduler_lock:
+                old_frame_scheduler = self.frame_scheduler
+                self.frame_scheduler = frame_scheduler
+            if old_frame_scheduler is not None:
+                old_frame_scheduler.shutdown()
+
         # subscribers
         if 'ROS_img_msg_topic' not in self.config or \
-                self.config['ROS_img_msg_topic'] != config['ROS_img_msg_topic']:
+                self.config['ROS_img_msg_topic'] != config['ROS_img_msg_topic'] or \
+                self.config['ROS_img_msg_compressed'] != config['ROS_img_msg_compressed']:
             if hasattr(self, 'image_sub'):
                 self.image_sub.unregister()
             self.image_sub = rospy.Subscriber(
                 config['ROS_img_msg_topic'],
-                Image,
-                self._image_callback,
+                CompressedImage if config['ROS_img_msg_compressed'] else Image,
+                self.image_mailbox.put,
                 queue_size=config['ROS_img_queue_size'],
                 tcp_nodelay=True,
                 buff_size=60000000)
@@ -6,13 +6,27 @@ import cv2
 
 
 class BallFinder():
-    def __init__(self, cascade, config, debug_printer):
-        # type: (np.matrix, cv2.CascadeClassifier, dict, DebugPrinter) -> None
+    """
+    Finds ball candidates with a cascade classifier.
+
+    With a field boundary detector, only the region below the field boundary is searched.
+    It is split into horizontal bands, each searched for balls of the diameter expected in its rows.
+    The expected diameter is interpolated linearly between the highest point of the field boundary
+    and the bottom of the image, because balls further away appear smaller and higher in the image.
+
+    The vision node does not create a BallFinder, as there is no ball_classifier using a cascade classifier.
+    It is used as a library, e.g. by scripts with their own trained cascade.
+    The ball_finder parameters of the vision config are the keys of the config passed to __init__.
+    """
+
+    def __init__(self, cascade, config, debug_printer, field_boundary_detector=None):
+        # type: (cv2.CascadeClassifier, dict, DebugPrinter, FieldBoundaryDetector) -> None
         self._candidates = None
         self._ball = None
         self._cascade = cascade
         self._image = None
         self._debug_printer = debug_printer
+        self._field_boundary_detector = field_boundary_detector
 
         self._debug = False
 
@@ -21,6 +35,10 @@ class BallFinder():
         self._scale_factor = config['ball_finder_scale_factor']
         self._min_neighbors = config['ball_finder_min_neighbors']
         self._min_size = config['ball_finder_min_size']
+        self._band_count = config['ball_finder_band_count']
+        self._diameter_at_boundary = config['ball_finder_diameter_at_boundary']
+        self._diameter_at_bottom = config['ball_finder_diameter_at_bottom']
+        self._size_tolerance = config['ball_finder_size_tolerance']
 
     def set_image(self, image):
         self._image = image
@@ -33,15 +51,67 @@ class BallFinder():
         self._scale_factor = config['scale_factor']
         self._min_neighbors = config['min_neighbors']
         self._min_size = config['min_size']
+        self._band_count = config['band_count']
+        self._diameter_at_boundary = config['diameter_at_boundary']
+        self._diameter_at_bottom = config['diameter_at_bottom']
+        self._size_tolerance = config['size_tolerance']
 
 
     def get_ball_candidates(self):
         # type: () -> list
         if self._candidates is None:
-            image_gray = cv2.cvtColor(self._image, cv2.COLOR_BGR2GRAY)
-            self._raw_candidates = self._cascade.detectMultiScale(image_gray,
-                                                              scaleFactor=self._scale_factor,
-                                                              minNeighbors=self._min_neighbors,
-                                                              minSize=(self._min_size, self._min_size))
+            if self._field_boundary_detector is None or self._band_count < 1:
+                image_gray = cv2.cvtColor(self._image, cv2.COLOR_BGR2GRAY)
+                self._raw_candidates = self._cascade.detectMultiScale(image_gray,
+                                                                  scaleFactor=self._scale_factor,
+                                                                  minNeighbors=self._min_neighbors,
+                                                                  minSize=(self._min_size, self._min_size))
+            else:
+                self._raw_candidates = self._detect_in_bands()
             self._candidates = [Candidate(*candidate) for candidate in self._raw_candidates]
         return self._candidates
+
+    def _detect_in_bands(self):
+        # type: () -> list
+        """
+        searches the bands below the field boundary for balls of their expected size
+        :return: list of (x, y, width, height) in image coordinates
+        """
+        height = self._image.shape[0]
+        top = min(self._field_boundary_detector.get_upper_bound(), height - 1)
+        # converting only the region below the field boundary
+        image_gray = cv2.cvtColor(self._image[top:], cv2.COLOR_BGR2GRAY)
+        band_height = (height - top) / float(self._band_count)
+        detections = []
+        for band in range(self._band_count):
+            band_top = int(top + band * band_height)
+            band_bottom = int(top + (band + 1) * band_height)
+            min_size = max(self._min_size, int(self.get_expected_diameter(band_top) * (1 - self._size_tolerance)))
+            max_size = int(self.get_expected_diameter(band_bottom) * (1 + self._size_tolerance)) + 1
+            # the search region reaches below the band, so balls with their center in the band fit completely
+            region_top = max(top, band_top - max_size // 2)
+            region_bottom = min(height, band_bottom + max_size // 2)
+            if region_bottom - region_top < min_size:
+                continue
+            region = image_gray[region_top - top:region_bottom - top]
+            for x, y, w, h in self._cascade.detectMultiScale(region,
+                                                             scaleFactor=self._scale_factor,
+                                                             minNeighbors=self._min_neighbors,
+                                                             minSize=(min_size, min_size),
+                                                             maxSize=(max_size, max_size)):
+                # every ball belongs to the band containing its center
+                if band_top <= region_top + y + h // 2 < band_bottom:
+                    detections.append((int(x), int(region_top + y), int(w), int(h)))
+        return detections
+
+    def get_expected_diameter(self, y):
+        # type: (int) -> float
+        """
+        returns the diameter a ball is expected to have in the given image row
+        :param y: the image row
+        :return: the diameter in pixels
+        """
+        top = self._field_boundary_detector.get_upper_bound()
+        height = self._image.shape[0]
+        position = min(max((y - top) / float(max(1, height - top)), 0.0), 1.0)
+        return self._diameter_at_boundary + position * (self._diameter_at_bottom - self._diameter_at_boundary)
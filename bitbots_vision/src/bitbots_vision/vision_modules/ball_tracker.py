@@ -0,0 +1,197 @@
+from .candidate import CandidateFinder, Candidate
+from .debug import DebugPrinter
+
+
+class BallTracker(CandidateFinder):
+    """
+    BallTracker wraps a ball detector (e.g. the FcnnHandler) and reduces its work while a ball is tracked.
+
+    The position of the ball is predicted with a constant velocity (alpha-beta) filter.
+    While the ball is tracked, the detector only runs on a window around the predicted position.
+    The whole image is searched every full_frame_interval images and after the ball was missed in the window,
+    so a lost ball is found again after one image at the latest.
+    Detectors without a set_window method run on the whole image every time.
+
+    Example configuration:
+
+    full_frame_interval: 10  # search the whole image at least every 10 images
+    window_factor: 3.0  # size of the window relative to the diameter of the ball
+    min_window_size: 64  # minimal size of the window in pixels
+    alpha: 0.8  # weight of the measured position
+    beta: 0.3  # weight of the measured velocity
+    """
+
+    def __init__(self, detector, config, debug_printer):
+        # type: (CandidateFinder, dict, DebugPrinter) -> None
+        self._detector = detector
+        self._debug_printer = debug_printer
+        self.set_config(config)
+
+        self._has_image = False
+        self._updated = True
+        self._frames_since_full_frame = 0
+        self._window = None  # window of the current image, None for the whole image
+        self._stamp = None
+        # in the pipelined mode of the detector, the results belong to the previous image
+        self._previous_window = None
+        # track state: center, velocity in pixels per second (or per image without stamps), diameter and time
+        self._position = None
+        self._velocity = (0.0, 0.0)
+        self._diameter = None
+        self._time = None
+        self._frame_count = 0
+
+    def set_config(self, config):
+        # type: (dict) -> None
+        """
+        updates the configuration, the track is kept
+        :param config: the configuration, see the example configuration
+        """
+        self._full_frame_interval = config['full_frame_interval']
+        self._window_factor = config['window_factor']
+        self._min_window_size = config['min_window_size']
+        self._alpha = config['alpha']
+        self._beta = config['beta']
+
+    def set_image(self, image, stamp=None):
+        """
+        sets the image to work on and chooses the region the detector runs on
+        :param image: the current image
+        :param stamp: the header stamp of the image
+        """
+        # the track has to contain the results of the previous image
+        self._update()
+        self._frame_count += 1
+        self._previous_window = self._window
+        self._stamp = stamp
+
+        self._window = None
+        if self._position is not None \
+                and self._frames_since_full_frame + 1 < self._full_frame_interval \
+                and hasattr(self._detector, 'set_window'):
+            self._window = self._get_window(image, self._get_time(stamp))
+        if self._window is None:
+            self._frames_since_full_frame = 0
+        else:
+            self._frames_since_full_frame += 1
+        if hasattr(self._detector, 'set_window'):
+            self._detector.set_window(self._window)
+        self._detector.set_image(image, stamp)
+        self._has_image = True
+        self._updated = False
+
+    def get_detector(self):
+        """
+        returns the wrapped ball detector
+        """
+        return self._detector
+
+    def get_image_stamp(self):
+        """
+        returns the stamp of the image the candidates belong to
+        """
+        if hasattr(self._detector, 'get_image_stamp'):
+            return self._detector.get_image_stamp()
+        return self._stamp
+
+    def get_image_field_boundary(self):
+        """
+        returns the field boundary of the image the candidates belong to, None for the current field boundary
+        """
+        if hasattr(self._detector, 'get_image_field_boundary'):
+            return self._detector.get_image_field_boundary()
+        return None
+
+    def compute_top_candidate(self):
+        self._detector.compute_top_candidate()
+
+    def get_candidates(self):
+        """
+        returns the candidates of the detector in image coordinates
+        """
+        candidates = self._detector.get_candidates()
+        self._update()
+        return candidates
+
+    def get_top_candidates(self, count=1):
+        return self._detector.get_top_candidates(count)
+
+    def get_debug_image(self):
+        return self._detector.get_debug_image()
+
+    def get_cropped_msg(self):
+        return self._detector.get_cropped_msg()
+
+    def _update(self):
+        """
+        updates the track with the best candidate of the current image (once per image)
+        """
+        if self._updated or not self._has_image:
+            return
+        self._updated = True
+        candidates = self._detector.get_candidates()
+        stamp = self.get_image_stamp()
+        window = self._window if stamp == self._stamp else self._previous_window
+        if not candidates:
+            if window is None:
+                # nothing in the whole image
+                self._position = None
+                self._debug_printer.info('ball tracking: no ball', 'tracker')
+            else:
+                # search the whole image for the next image
+                self._frames_since_full_frame = self._full_frame_interval
+                self._debug_printer.info('ball tracking: missed ball in window', 'tracker')
+            return
+        ball = max(candidates, key=lambda candidate: candidate.rating)
+        self._correct(ball, self._get_time(stamp))
+
+    def _get_time(self, stamp):
+        # type: (object) -> float
+        """
+        returns the time of an image in seconds, or the number of the image if there is no stamp
+        """
+        if stamp is None:
+            return float(self._frame_count)
+        return stamp.to_sec()
+
+    def _correct(self, ball, time):
+        # type: (Candidate, float) -> None
+        """
+        corrects the track with a measured ball
+        """
+        measurement = ball.get_center_point()
+        if self._position is None:
+            self._position = measurement
+            self._velocity = (0.0, 0.0)
+        else:
+            dt = max(time - self._time, 1e-3)
+            predicted = self._predict(time)
+            residual = (measurement[0] - predicted[0], measurement[1] - predicted[1])
+            self._position = (predicted[0] + self._alpha * residual[0], predicted[1] + self._alpha * residual[1])
+            self._velocity = (self._velocity[0] + self._beta * residual[0] / dt,
+                              self._velocity[1] + self._beta * residual[1] / dt)
+        self._diameter = ball.get_diameter()
+        self._time = time
+
+    def _predict(self, time):
+        # type: (float) -> tuple
+        """
+        returns the predicted center of the ball at the given time
+        """
+        dt = max(time - self._time, 0.0)
+        return self._position[0] + self._velocity[0] * dt, self._position[1] + self._velocity[1] * dt
+
+    def _get_window(self, image, time):
+        # type: (np.array, float) -> tuple
+        """
+        returns the window around the predicted ball position, None if the ball left the image
+        """
+        height, width = image.shape[:2]
+        center_x, center_y = self._predict(time)
+        if not (0 <= center_x < width and 0 <= center_y < height):
+            return None
+        half_size = max(self._min_window_size, self._window_factor * self._diameter) / 2.0
+        return (int(max(0, center_x - half_size)),
+                int(max(0, center_y - half_size)),
+                int(min(width, center_x + half_size)),
+                int(min(height, center_y + half_size)))
@@ -5,8 +5,14 @@ from .debug import DebugPrinter
 
 
 class ClassifierHandler(CandidateFinder):
-    def __init__(self, classifier, debug_printer):
-        # type: (LiveClassifier, DebugPrinter) -> None
+    def __init__(self, classifier, debug_printer, max_batch_size=32):
+        # type: (LiveClassifier, DebugPrinter, int) -> None
+        """
+        rates candidates with a classifier of image crops
+        :param classifier: the classifier, e.g. a LiveClassifier
+        :param debug_printer: debug-printer
+        :param max_batch_size: maximal number of crops classified in one call of the classifier
+        """
         self._image = None
         self._input_candidates = None
         self._classifier = classifier
@@ -14,6 +20,11 @@ class ClassifierHandler(CandidateFinder):
         self._sorted_candidates = None
         self._top_candidate = None
         self._debug_printer = debug_printer
+        self._max_batch_size = max(1, max_batch_size)
+        # preallocated batches of the crops, filled by every call of the classifier
+        height, width, channels = classifier.input_shape
+        self._crop_batch = np.empty((self._max_batch_size, height, width, channels), dtype=np.uint8)
+        self._input_batch = np.empty((self._max_batch_size, height, width, channels), dtype=np.float32)
 
     def set_image(self, image, candidates):
         self._image = image
@@ -24,22 +35,51 @@ class ClassifierHandler(CandidateFinder):
 
     def get_candidates(self):
         if self._classified_candidates is None:
-            batch = list()
             if self._input_candidates:
-                for item in self._input_candidates:
-                    image_cropped = cv2.resize(self._image[item.get_upper_left_y(): item.get_upper_left_y()+item.get_height(),
-                                               item.get_upper_left_x(): item.get_upper_left_x()+item.get_width()],
-                                               (self._classifier.input_shape[0], self._classifier.input_shape[1]))
-                    batch.append(image_cropped.astype(np.float32) / 255.0)
-                # classify whole batch of images
-                batch_conf = self._classifier.predict(batch)
-                for i in range(len(batch_conf)):
-                    self._input_candidates[i].rating=batch_conf[i]
+                boxes = self._get_crop_boxes()
+                # classify the crops in batches of at most max_batch_size
+                for start in range(0, len(boxes), self._max_batch_size):
+                    confidences = self._classify(boxes[start:start + self._max_batch_size])
+                    for candidate, confidence in zip(self._input_candidates[start:], confidences):
+                        candidate.rating = float(confidence)
                 self._classified_candidates = self._input_candidates
             else:
                 self._classified_candidates = list()
         return self._classified_candidates
 
+    def _get_crop_boxes(self):
+        # type: () -> np.array
+        """
+        returns the boxes of all input candidates clipped to the image, every box contains at least one pixel
+        :return: int array of shape (n, 4) containing x1, y1, x2, y2
+        """
+        height, width = self._image.shape[:2]
+        boxes = np.array([(candidate.get_upper_left_x(),
+                           candidate.get_upper_left_y(),
+                           candidate.get_lower_right_x(),
+                           candidate.get_lower_right_y()) for candidate in self._input_candidates], dtype=int)
+        boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+        boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+        boxes[:, [0, 1]] = np.minimum(boxes[:, [0, 1]], np.array([width - 1, height - 1]))
+        boxes[:, 2] = np.maximum(boxes[:, 2], boxes[:, 0] + 1)
+        boxes[:, 3] = np.maximum(boxes[:, 3], boxes[:, 1] + 1)
+        return boxes
+
+    def _classify(self, boxes):
+        # type: (np.array) -> np.array
+        """
+        resizes the crops into the preallocated batch and classifies them in one call
+        :param boxes: int array of shape (n, 4) containing x1, y1, x2, y2, n is at most max_batch_size
+        :return: the confidences of the crops
+        """
+        count = len(boxes)
+        crop_size = (self._crop_batch.shape[2], self._crop_batch.shape[1])
+        for i, (x1, y1, x2, y2) in enumerate(boxes):
+            cv2.resize(self._image[y1:y2, x1:x2], crop_size, dst=self._crop_batch[i])
+        # normalize all crops at once
+        np.multiply(self._crop_batch[:count], 1 / 255.0, out=self._input_batch[:count], casting='unsafe')
+        return np.asarray(self._classifier.predict(self._input_batch[:count])).reshape(count)
+
     def get_top_candidates(self, count=1):
         if self._sorted_candidates is None:
             self._sorted_candidates = sorted(self.get_candidates(), key=lambda x: x.rating)
@@ -13,13 +13,18 @@ import rospy
 import VisionExtensions
 import numpy as np
 import os
+import threading
 from collections import deque
 from cv_bridge import CvBridge
 from sensor_msgs.msg import Image
 from bitbots_msgs.msg import ColorSpace
 from .debug import DebugPrinter
+from .image_decoding import yuv_to_bgr_table, bgr_colors_to_yuv
 
-
+# color spaces loaded in this process, (resolved path, yuv) -> (modification time, read-only color space)
+_color_space_cache = {}
+# the yuv color spaces are created from the cached bgr color spaces while holding the lock
+_color_space_cache_lock = threading.RLock()
 
 
 class ColorDetector(object):
@@ -27,18 +32,36 @@ class ColorDetector(object):
     ColorDetector is abstract super-class of specialized sub-classes.
     ColorDetectors are used e.g. to check, if a pixel matches the defined color space
     or to create masked binary images.
+
+    With yuv_input, the detector can also work on yuv images (see image_decoding.imgmsg_to_yuv).
+    The color spaces are still defined for bgr colors and additionally converted into lookup tables for yuv values,
+    so yuv422 images of the camera are classified without converting them first.
+    Whether the following images are yuv or bgr images is set with set_yuv_image,
+    images of other sources are classified as bgr images.
     """
 
-    def __init__(self, debug_printer):
-        # type: (DebugPrinter) -> None
+    def __init__(self, debug_printer, yuv_input=False):
+        # type: (DebugPrinter, bool) -> None
         """
         Initialization of ColorDetector.
 
         :param DebugPrinter debug_printer: debug-printer
+        :param bool yuv_input: whether the detector also classifies yuv images, see set_yuv_image
         :return: None
         """
         self._debug_printer = debug_printer
-        pass
+        self._yuv_input = yuv_input
+        self._yuv_image = yuv_input
+
+    def set_yuv_image(self, yuv_image):
+        # type: (bool) -> None
+        """
+        Sets whether the following images and pixels are yuv instead of bgr, this needs yuv_input
+
+        :param bool yuv_image: whether the images and pixels are yuv
+        :return: None
+        """
+        self._yuv_image = yuv_image and self._yuv_input
 
     @abc.abstractmethod
     def match_pixel(self, pixel):
@@ -105,25 +128,41 @@ class ColorDetector(object):
         pic[0][0] = pixel
         return cv2.cvtColor(pic, cv2.COLOR_BGR2HSV)[0][0]
 
+    @staticmethod
+    def bgr_color_space_to_yuv(color_space):
+        # type: (np.array) -> np.array
+        """
+        Converts a lookup table indexed by bgr values into a lookup table indexed by yuv values.
+        A yuv value is accepted, if the bgr color it is decoded into (see image_decoding.yuv_to_bgr_table) is accepted.
+
+        :param np.array color_space: lookup table of shape (256, 256, 256) indexed by b, g and r
+        :return np.array: lookup table of shape (256, 256, 256) indexed by y, u and v
+        """
+        bgr = yuv_to_bgr_table()
+        return color_space[bgr[..., 0], bgr[..., 1], bgr[..., 2]]
+
 
 class HsvSpaceColorDetector(ColorDetector):
     """
     HsvSpaceColorDetector is a ColorDetector, that is based on the HSV-color space.
     The HSV-color space is adjustable by setting min- and max-values for hue, saturation and value.
+    With yuv_input, the HSV-color space is additionally converted into a lookup table for yuv values.
     """
-    def __init__(self, debug_printer, min_vals, max_vals):
-        # type: (DebugPrinter, tuple[int, int, int], tuple[int, int, int]) -> None
+    def __init__(self, debug_printer, min_vals, max_vals, yuv_input=False):
+        # type: (DebugPrinter, tuple[int, int, int], tuple[int, int, int], bool) -> None
         """
         Initialization of HsvSpaceColorDetector.
 
         :param DebugPrinter debug_printer: debug-printer
         :param tuple min_vals: a tuple of the minimal accepted hsv-values
         :param tuple max_vals: a tuple of the maximal accepted hsv-values
+        :param bool yuv_input: whether the detector also classifies yuv images, see set_yuv_image
         :return: None
         """
-        super(HsvSpaceColorDetector, self).__init__(debug_printer)
-        self.min_vals = np.array(min_vals)
-        self.max_vals = np.array(max_vals)
+        super(HsvSpaceColorDetector, self).__init__(debug_printer, yuv_input)
+        self.min_vals = None
+        self.max_vals = None
+        self.set_config(min_vals, max_vals)
 
     def set_config(self, min_vals, max_vals):
         # type: (tuple[int, int, int], tuple[int, int, int]) -> None
@@ -134,17 +173,27 @@ class HsvSpaceColorDetector(ColorDetector):
         :param max_vals: a tuple of the maximal accepted hsv-values
         :return: None
         """
-        self.min_vals = np.array(min_vals)
-        self.max_vals = np.array(max_vals)
+        min_vals = np.array(min_vals)
+        max_vals = np.array(max_vals)
+        if np.array_equal(min_vals, self.min_vals) and np.array_equal(max_vals, self.max_vals):
+            return
+        self.min_vals = min_vals
+        self.max_vals = max_vals
+        if self._yuv_input:
+            # hsv-values of all yuv-values, the lookup table is only rebuilt when the hsv-space changed
+            hsv = cv2.cvtColor(yuv_to_bgr_table().reshape(4096, 4096, 3), cv2.COLOR_BGR2HSV)
+            self._yuv_color_space = cv2.inRange(hsv, self.min_vals, self.max_vals).reshape(256, 256, 256)
 
     def match_pixel(self, pixel):
         # type: (np.array) -> bool
         """
-        Returns if bgr pixel is in color space
+        Returns if bgr pixel (yuv pixel after set_yuv_image) is in color space
 
         :param np.array pixel: bgr-pixel
         :return bool: whether pixel is in color space or not
         """
+        if self._yuv_image:
+            return self._yuv_color_space[pixel[0], pixel[1], pixel[2]] > 0
         pixel = self.pixel_bgr2hsv(pixel)
         # TODO: optimize comparisons
         return (self.max_vals[0] >= pixel[0] >= self.min_vals[0]) and \
@@ -160,6 +209,8 @@ class HsvSpaceColorDetector(ColorDetector):
         :param np.array image: image to mask
         :return np.array: masked image
         """
+        if self._yuv_image:
+            return VisionExtensions.maskImg(image, self._yuv_color_space)
         image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
         return cv2.inRange(image, self.min_vals, self.max_vals)
 
@@ -193,6 +244,7 @@ class PixelListColorDetector(ColorDetector):
     PixelListColorDetector is a ColorDetector, that is based on a lookup table of color values.
     The color space is loaded from color-space-file at color_path (in config).
     The color space is represented by boolean-values for RGB-color-values.
+    With yuv_input, it is additionally converted into boolean-values for yuv-values after loading.
 
     Publishes: 'ROS_field_mask_image_msg_topic'-messages
 
@@ -202,7 +254,7 @@ class PixelListColorDetector(ColorDetector):
         'field_color_detector_path'
     """
 
-    def __init__(self, debug_printer, package_path, config):
+    def __init__(self, debug_printer, package_path, config, yuv_input=False):
         # type:(DebugPrinter, str, dict, bool) -> None
         """
         Initialization of PixelListColorDetector.
@@ -210,9 +262,10 @@ class PixelListColorDetector(ColorDetector):
         :param DebugPrinter debug_printer: debug-printer
         :param str package_path: path of package
         :param dict config: vision config
+        :param bool yuv_input: whether the detector also classifies yuv images, see set_yuv_image
         :return: None
         """
-        super(PixelListColorDetector, self).__init__(debug_printer)
+        super(PixelListColorDetector, self).__init__(debug_printer, yuv_input)
         self.bridge = CvBridge()
 
         self.config = config
@@ -230,7 +283,47 @@ class PixelListColorDetector(ColorDetector):
             Image,
             queue_size=1)
 
-        self.color_space = self.init_color_space(self.color_path)
+        self.color_space = self.load_color_space(self.color_path)
+        if self._yuv_input:
+            self._yuv_color_space = self.load_color_space(self.color_path, yuv=True)
+
+    def set_config(self, config):
+        # type: (dict) -> None
+        """
+        Updates the configuration without reloading the color space.
+        Changes of the color space files or topics need a new detector.
+
+        :param dict config: vision config
+        :return: None
+        """
+        self.config = config
+
+    def load_color_space(self, color_path, yuv=False):
+        # type: (str, bool) -> np.array
+        """
+        Returns the color space of a file, optionally converted to yuv.
+        The color spaces are cached for the whole process by the path and the modification time of the file,
+        so detectors using the same file share one read-only color space and the file is only loaded again after it changed.
+
+        :param str color_path: path to file containing the accepted colors
+        :param bool yuv: whether the color space is indexed by yuv values instead of bgr values
+        :return np.array: read-only color space
+        """
+        color_path = os.path.realpath(color_path)
+        modification_time = os.path.getmtime(color_path)
+        key = (color_path, yuv)
+        with _color_space_cache_lock:
+            cached = _color_space_cache.get(key)
+            if cached is not None and cached[0] == modification_time:
+                return cached[1]
+            if yuv:
+                color_space = self.bgr_color_space_to_yuv(self.load_color_space(color_path))
+            else:
+                color_space = self.init_color_space(color_path)
+            color_space.flags.writeable = False
+            # replaces the color space of an older version of the file
+            _color_space_cache[key] = (modification_time, color_space)
+            return color_space
 
     def init_color_space(self, color_path):
         # type: (str) -> None
@@ -278,6 +371,8 @@ class PixelListColorDetector(ColorDetector):
         :param np.array pixel: bgr-pixel
         :return bool: whether pixel is in color space or not
         """
+        if self._yuv_image:
+            return self._yuv_color_space[pixel[0], pixel[1], pixel[2]]
         return self.color_space[pixel[0], pixel[1], pixel[2]]
 
     def mask_image(self, image):
@@ -289,7 +384,7 @@ class PixelListColorDetector(ColorDetector):
         :param np.array image: image to mask
         :return np.array: masked image
         """
-        mask = VisionExtensions.maskImg(image, self.color_space)
+        mask = VisionExtensions.maskImg(image, self._yuv_color_space if self._yuv_image else self.color_space)
 
         # toggle publishing of 'field_mask'-messages   
         if self.config['vision_publish_field_mask_image']:
@@ -310,8 +405,8 @@ class DynamicPixelListColorDetector(PixelListColorDetector):
         'ROS_dynamic_color_space_field_mask_image_msg_topic'-messages
     """
 
-    def __init__(self, debug_printer, package_path, config, primary_detector=False):
-        # type:(DebugPrinter, str, dict, bool) -> None
+    def __init__(self, debug_printer, package_path, config, primary_detector=False, yuv_input=False):
+        # type:(DebugPrinter, str, dict, bool, bool) -> None
         """
         Initialization of DynamicPixelListColorDetector.
 
@@ -321,13 +416,17 @@ class DynamicPixelListColorDetector(PixelListColorDetector):
         :param bool primary_detector: true if is primary color detector
             (only detector held by vision should be True) (Default: False)
             This allows publishing of field mask images.
+        :param bool yuv_input: whether the detector also classifies yuv images, see set_yuv_image
         :return: None
         """
-        super(DynamicPixelListColorDetector, self).__init__(debug_printer, package_path, config)
+        super(DynamicPixelListColorDetector, self).__init__(debug_printer, package_path, config, yuv_input)
 
         self.primary_detector = primary_detector
 
-        self.base_color_space = np.copy(self.color_space)
+        # the color space is read-only, the dynamic color spaces are created as copies
+        self.base_color_space = self.color_space
+        if self._yuv_input:
+            self._base_yuv_color_space = self._yuv_color_space
 
         # toggle publishing of mask_img msg
         self.publish_field_mask_img_msg = self.config['vision_publish_field_mask_image']
@@ -349,6 +448,19 @@ class DynamicPixelListColorDetector(PixelListColorDetector):
             Image,
             queue_size=1)
 
+    def set_config(self, config):
+        # type: (dict) -> None
+        """
+        Updates the configuration without reloading the color space.
+        Changes of the color space files or topics need a new detector.
+
+        :param dict config: vision config
+        :return: None
+        """
+        super(DynamicPixelListColorDetector, self).set_config(config)
+        self.publish_field_mask_img_msg = self.config['vision_publish_field_mask_image']
+        self.publish_dyn_field_mask_msg = self.config['dynamic_color_space_publish_field_mask_image']
+
     def mask_image(self, image):
         # type: (np.array) -> np.array
         """
@@ -358,10 +470,16 @@ class DynamicPixelListColorDetector(PixelListColorDetector):
         :param np.array image: image to mask
         :return np.array: masked image
         """
-        dyn_mask = VisionExtensions.maskImg(image, self.color_space)
+        if self._yuv_image:
+            dyn_mask = VisionExtensions.maskImg(image, self._yuv_color_space)
+        else:
+            dyn_mask = VisionExtensions.maskImg(image, self.color_space)
 
         if self.publish_field_mask_img_msg:
-            static_mask = VisionExtensions.maskImg(image, self.base_color_space)
+            if self._yuv_image:
+                static_mask = VisionExtensions.maskImg(image, self._base_yuv_color_space)
+            else:
+                static_mask = VisionExtensions.maskImg(image, self.base_color_space)
 
         # toggle publishing of dynamic field masks
         if (self.primary_detector and self.publish_dyn_field_mask_msg):
@@ -401,5 +519,13 @@ class DynamicPixelListColorDetector(PixelListColorDetector):
             msg.green,
             msg.red] = 1
 
+        # the dynamic colors are bgr colors, the yuv-values decoded into them are added to the yuv color space
+        if self._yuv_input:
+            yuv_color_space_temp = np.copy(self._base_yuv_color_space)
+            if len(msg.blue) > 0:
+                yuv = bgr_colors_to_yuv(np.array([msg.blue, msg.green, msg.red]).T)
+                yuv_color_space_temp[yuv[:, 0], yuv[:, 1], yuv[:, 2]] = 1
+            self._yuv_color_space = yuv_color_space_temp
+
         # Switches the reference to the new color space
         self.color_space = color_space_temp
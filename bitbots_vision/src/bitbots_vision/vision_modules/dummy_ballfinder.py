@@ -7,7 +7,7 @@ class DummyClassifier(CandidateFinder):
         self._sorted_candidates = []
         self._top_candidate = None
 
-    def set_image(self, image):
+    def set_image(self, image, stamp=None):
         pass
 
     def compute_top_candidate(self):
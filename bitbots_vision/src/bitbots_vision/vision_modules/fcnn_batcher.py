@@ -0,0 +1,121 @@
+import time
+import threading
+from concurrent.futures import Future
+from .live_fcnn_03 import FcnnModel
+
+
+class FcnnBatcher(object):
+    """
+    FcnnBatcher runs the images of several callers through a fcnn in one batch.
+    The callers are e.g. the FcnnHandlers of multiple cameras, running in their own threads.
+    It provides the predict and predict_async methods of a FcnnModel, so it can be passed to a FcnnHandler instead of the model.
+
+    A batch is run as soon as max_batch_size images are waiting or the oldest waiting image waited max_wait seconds.
+    With max_wait 0, a batch contains the images which queued up while the previous batch was running.
+    Only images of the same size and type are batched together.
+    """
+
+    def __init__(self, fcnn, max_batch_size=4, max_wait=0.005):
+        # type: (FcnnModel, int, float) -> None
+        """
+        :param fcnn: the fcnn running the batches
+        :param max_batch_size: maximal number of images in a batch
+        :param max_wait: maximal time in seconds an image waits for other images
+        """
+        self._fcnn = fcnn
+        self.input_shape = fcnn.input_shape
+        self.output_shape = fcnn.output_shape
+        self._max_batch_size = max(1, max_batch_size)
+        self._max_wait = max_wait
+
+        # waiting requests as tuples of (time of the request, list of images, future)
+        self._requests = []
+        self._shutdown = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict(self, batch):
+        """
+        Runs the images in a batch together with the images of other callers.
+
+        :param batch: list of bgr images (uint8) or of rgb images (float32, values between 0 and 1)
+        :return: np.array of shape (batch size, height, width, 1)
+        """
+        return self.predict_async(batch).result()
+
+    def predict_async(self, batch):
+        """
+        Queues the images for the next batch.
+
+        :param batch: list of bgr images (uint8) or of rgb images (float32, values between 0 and 1)
+        :return: concurrent.futures.Future of the predict result
+        """
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('the fcnn batcher is shut down')
+            self._requests.append((time.time(), list(batch), future))
+            self._condition.notify()
+        return future
+
+    def shutdown(self):
+        """
+        Stops the batching thread after the waiting requests are processed.
+        The fcnn itself is not shut down.
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            requests = self._collect_requests()
+            if not requests:
+                return
+            images = [image for _, request_images, _ in requests for image in request_images]
+            try:
+                out = self._fcnn.predict(images)
+            except Exception as e:
+                for _, _, future in requests:
+                    future.set_exception(e)
+                continue
+            # every caller gets the outputs of its images, which are in the order the images were joined
+            start = 0
+            for _, request_images, future in requests:
+                future.set_result(out[start:start + len(request_images)])
+                start += len(request_images)
+
+    def _collect_requests(self):
+        """
+        Waits until a batch is complete and removes its requests from the waiting requests.
+        The first request is always part of the batch, even if it is larger than max_batch_size.
+        Returns an empty batch, when the batcher is shut down and no requests are waiting.
+        """
+        with self._condition:
+            while not self._requests and not self._shutdown:
+                self._condition.wait()
+            if not self._requests:
+                return []
+            while True:
+                first_image = self._requests[0][1][0]
+                same_shape = [request for request in self._requests
+                              if request[1][0].shape == first_image.shape and request[1][0].dtype == first_image.dtype]
+                remaining_time = self._requests[0][0] + self._max_wait - time.time()
+                if sum(len(request[1]) for request in same_shape) >= self._max_batch_size or remaining_time <= 0 or \
+                        self._shutdown:
+                    break
+                self._condition.wait(remaining_time)
+
+            batch = [same_shape[0]]
+            image_count = len(same_shape[0][1])
+            for request in same_shape[1:]:
+                if image_count + len(request[1]) > self._max_batch_size:
+                    break
+                batch.append(request)
+                image_count += len(request[1])
+            # the requests contain arrays, so they are removed by identity instead of by comparison
+            self._requests = [request for request in self._requests if not any(request is b for b in batch)]
+            return batch
@@ -7,6 +7,7 @@ from .candidate import CandidateFinder, Candidate
 import itertools
 import random
 import rospy
+from concurrent.futures import wait
 from .live_fcnn_03 import FCNN03
 from .debug import DebugPrinter
 
@@ -29,6 +30,21 @@ class FcnnHandler(CandidateFinder):
         max_ball_diameter: 150
         publish_output: false
         publish_field_boundary_offset: 5
+        crop_to_field_boundary: false  # runs the fcnn only on the image region below the field boundary
+        crop_margin: 20  # margin above the field boundary in pixels, when cropping
+        crop_scale: 1.0  # input resolution of the cropped region relative to the full image input resolution
+        candidate_method: 'findspots'  # findspots or components
+        pipelined: false  # runs the fcnn in the background, the results are one frame late
+        field_boundary_scale: 1  # size of the images of the handler relative to the images of the field boundary detector
+
+    In the pipelined mode, set_image hands the new image to the fcnn and the handler switches to the
+    previous image, whose fcnn output is (nearly) ready. Use get_image_stamp to match the results to their frame
+    and get_image_field_boundary to filter them with the field boundary of their frame.
+
+    set_window restricts the fcnn to a region of the image, this is used by the BallTracker.
+
+    Several handlers (e.g. one per camera) can share one fcnn through a FcnnBatcher,
+    which runs their images together in one batch.
     """
 
     def __init__(self, fcnn, field_boundary_detector, config, debug_printer):
@@ -39,19 +55,80 @@ class FcnnHandler(CandidateFinder):
         self._sorted_rated_candidates = None
         self._top_candidate = None
         self._fcnn_output = None
+        self._heatmap = None
+        self._heatmap_uint8 = None
+        self._heatmap_roi = None  # (x1, y1, x2, y2) of the image region the heatmap belongs to
+        self._heatmap_future = None
+        self._image_stamp = None
+        self._image_field_boundary = None
+        # (image, stamp, roi, future, field boundary) of the image currently processed by the fcnn
+        self._pending_frame = None
+        self._window = None
+        # persistent buffers reused every frame, see _get_buffer
+        self._buffers = dict()
+        self._input_buffer_index = 0
         self._debug_printer = debug_printer
         self.bridge = CvBridge()
         # init config
         self.set_config(config)
 
 
-    def set_image(self, image):
-        self._image = image
+    def set_image(self, image, stamp=None):
+        """
+        sets the image to work on
+        :param image: the current image
+        :param stamp: the header stamp of the image, returned by get_image_stamp
+        """
         self._rated_candidates = None
         self._sorted_rated_candidates = None
         self._top_candidate = None
         self._fcnn_output = None
+        self._heatmap = None
+        self._heatmap_uint8 = None
+        previous_future = self._heatmap_future
+        self._heatmap_future = None
+        if self._pipelined:
+            if previous_future is not None:
+                # the fcnn has to be done with the input buffer before it is reused for the new image
+                wait([previous_future])
+            # start the fcnn on the new image and continue with the previous one
+            in_img, roi = self._preprocess(image)
+            # the field boundary detector works on the new image, its field boundary is kept for the results
+            field_boundary = self._field_boundary_detector.get_full_convex_field_boundary()
+            frame = (image, stamp, roi, self._fcnn.predict_async(list([in_img])), field_boundary)
+            if self._pending_frame is None:
+                self._image, self._image_stamp, self._image_field_boundary = None, None, None
+            else:
+                self._image, self._image_stamp, self._heatmap_roi, self._heatmap_future, \
+                    self._image_field_boundary = self._pending_frame
+            self._pending_frame = frame
+        else:
+            self._image = image
+            self._image_stamp = stamp
+            self._image_field_boundary = None
+
+    def get_image_stamp(self):
+        """
+        returns the stamp of the image the candidates belong to.
+        In the pipelined mode, this is the stamp of the previous image.
+        """
+        return self._image_stamp
+
+    def get_image_field_boundary(self):
+        """
+        returns the full convex field boundary of the image the candidates belong to, in the coordinates of the
+        field boundary detector. In the pipelined mode, this is the field boundary of the previous image,
+        otherwise it is None for the current field boundary.
+        """
+        return self._image_field_boundary
 
+    def set_window(self, window):
+        """
+        restricts the fcnn to a region of the following images, e.g. around a tracked ball.
+        The region keeps the pixel density of the full image (multiplied by the crop scale) in the fcnn input.
+        :param window: (x1, y1, x2, y2) in image coordinates or None for the whole image
+        """
+        self._window = window
 
     def set_config(self, config):
         self._debug = config['debug']
@@ -64,6 +141,15 @@ class FcnnHandler(CandidateFinder):
         self._candidate_refinement_iteration_count = \
             config['candidate_refinement_iteration_count']
         self._field_boundary_offset = config['publish_field_boundary_offset']
+        self._crop_to_field_boundary = config['crop_to_field_boundary']
+        self._crop_margin = config['crop_margin']
+        self._crop_scale = config['crop_scale']
+        self._candidate_method = config['candidate_method']
+        self._pipelined = config['pipelined']
+        if not self._pipelined:
+            # the image processed in the background is not needed anymore
+            self._pending_frame = None
+        self._field_boundary_scale = config.get('field_boundary_scale', 1)
 
 
     def get_candidates(self):
@@ -72,20 +158,53 @@ class FcnnHandler(CandidateFinder):
         :return:
         """
         if self._rated_candidates is None:
-            self._rated_candidates = list()
-            for candidate in self._get_raw_candidates_cpp():
-                out = self.get_fcnn_output()
-                candidate.rating = np.mean(
-                    out[
-                        candidate.get_upper_left_y():
-                        candidate.get_upper_left_y() + candidate.get_height(),
-                        candidate.get_upper_left_x():
-                        candidate.get_upper_left_x() + candidate.get_width()]
-                ) / 255.0
-                if self.inspect_candidate(candidate):
-                    self._rated_candidates.append(candidate)
+            if self._image is None:
+                # the pipeline has no finished image yet
+                self._rated_candidates = list()
+                return self._rated_candidates
+            boxes = self._get_raw_boxes()
+            candidates = self._boxes_to_candidates(boxes, self._rate_boxes(boxes))
+            self._rated_candidates = [candidate for candidate in candidates if self.inspect_candidate(candidate)]
         return self._rated_candidates
 
+    def _rate_boxes(self, boxes):
+        # type: (np.array) -> np.array
+        """
+        Rates all boxes at once with the mean activation of the heatmap in their area.
+        The means are calculated with a summed-area table of the heatmap in the output resolution of the fcnn.
+        :param boxes: int array of shape (n, 4) containing x1, y1, x2, y2 in heatmap coordinates
+        :return: np.array of ratings between 0 and 1
+        """
+        if boxes.size == 0:
+            return np.empty(0)
+        heatmap = self._get_heatmap()
+        height, width = heatmap.shape
+        integral = cv2.integral(
+            heatmap, sum=self._get_buffer('integral', (height + 1, width + 1), np.float64), sdepth=cv2.CV_64F)
+        x1 = np.clip(boxes[:, 0], 0, width - 1)
+        x2 = np.clip(boxes[:, 2], x1 + 1, width)
+        y1 = np.clip(boxes[:, 1], 0, height - 1)
+        y2 = np.clip(boxes[:, 3], y1 + 1, height)
+        sums = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        return sums / ((x2 - x1) * (y2 - y1))
+
+    def _boxes_to_candidates(self, boxes, ratings):
+        # type: (np.array, np.array) -> list
+        """
+        scales boxes from heatmap coordinates to rated candidates in image coordinates
+        :param boxes: int array of shape (n, 4) containing x1, y1, x2, y2 in heatmap coordinates
+        :param ratings: the ratings of the boxes
+        :return: list of Candidate
+        """
+        if boxes.size == 0:
+            return list()
+        scale_x, scale_y = self._get_heatmap_scale()
+        image_boxes = np.round(boxes / np.array([scale_x, scale_y, scale_x, scale_y])).astype(int)
+        image_boxes[:, [0, 2]] += self._heatmap_roi[0]
+        image_boxes[:, [1, 3]] += self._heatmap_roi[1]
+        return [Candidate(x1, y1, x2 - x1, y2 - y1, float(rating))
+                for (x1, y1, x2, y2), rating in zip(image_boxes.tolist(), ratings)]
+
     def inspect_candidate(self, candidate):
         # type: (Candidate) -> bool
         return candidate.rating >= self._threshold \
@@ -136,33 +255,207 @@ class FcnnHandler(CandidateFinder):
         return self._sorted_rated_candidates[0:count]
 
     def get_fcnn_output(self):
+        """
+        returns the fcnn output scaled to the size of the image.
+        This is only needed for debug purposes, the candidates are computed in the resolution of the fcnn.
+        :return: np.array of type uint8 with the shape of the image
+        """
         if self._fcnn_output is None:
-            in_img = cv2.resize(self._image, (self._fcnn.input_shape[1], self._fcnn.input_shape[0]))
-            in_img = cv2.cvtColor(in_img, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
-            out = self._fcnn.predict(list([in_img]))
-            out = out.reshape(self._fcnn.output_shape[0], self._fcnn.output_shape[1])
-            out = (out * 255).astype(np.uint8)
-            self._fcnn_output = cv2.resize(out, (self._image.shape[1], self._image.shape[0]))
+            out = self._get_heatmap_uint8()
+            x1, y1, x2, y2 = self._heatmap_roi
+            self._fcnn_output = self._get_buffer('fcnn_output', self._image.shape[:2], np.uint8)
+            # everything outside of the region of interest has no activation
+            self._fcnn_output.fill(0)
+            region = self._fcnn_output[y1:y2, x1:x2]
+            if region.flags['C_CONTIGUOUS']:
+                cv2.resize(out, (x2 - x1, y2 - y1), dst=region)
+            else:
+                region[:] = cv2.resize(out, (x2 - x1, y2 - y1))
         return self._fcnn_output
 
-    def _get_raw_candidates_cpp(self):
+    def _get_heatmap(self):
+        # type: () -> np.array
+        """
+        returns the raw output of the fcnn (float32, values between 0 and 1) in its own resolution
+        """
+        if self._heatmap is None:
+            if self._heatmap_future is not None:
+                # the fcnn was started on this image in the pipelined mode
+                out = self._heatmap_future.result()
+            else:
+                in_img, self._heatmap_roi = self._preprocess(self._image)
+                out = self._fcnn.predict(list([in_img]))
+            self._heatmap = out.reshape(out.shape[1], out.shape[2])
+        return self._heatmap
+
+    def _get_heatmap_uint8(self):
+        # type: () -> np.array
+        """
+        returns the output of the fcnn as uint8 (values between 0 and 255) in its own resolution
+        """
+        if self._heatmap_uint8 is None:
+            heatmap = self._get_heatmap()
+            self._heatmap_uint8 = self._get_buffer('heatmap_uint8', heatmap.shape, np.uint8)
+            cv2.convertScaleAbs(heatmap, dst=self._heatmap_uint8, alpha=255)
+        return self._heatmap_uint8
+
+    def _get_buffer(self, name, shape, dtype):
+        # type: (str, tuple, type) -> np.array
+        """
+        returns a persistent buffer, which is only reallocated when its shape or type changes.
+        The content of the buffer is undefined.
+        :param name: name of the buffer
+        :param shape: shape of the buffer
+        :param dtype: type of the buffer
+        :return: np.array
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
 
+    def _preprocess(self, image):
+        # type: (np.array) -> tuple
+        """
+        crops and resizes an image for the fcnn, the fcnn converts the bgr image itself
+        :param image: the image
+        :return: the network input and the cropped region (x1, y1, x2, y2)
+        """
+        x1, y1, x2, y2 = self._get_roi(image)
+        roi = image[y1:y2, x1:x2]
+        width, height = self._get_input_size(image, roi)
+        # two alternating buffers, in the pipelined mode the fcnn may still work on the previous input
+        self._input_buffer_index = (self._input_buffer_index + 1) % 2
+        in_img = self._get_buffer('input{}'.format(self._input_buffer_index), (height, width, 3), np.uint8)
+        cv2.resize(roi, (width, height), dst=in_img)
+        return in_img, (x1, y1, x2, y2)
+
+    def _get_heatmap_scale(self):
+        # type: () -> tuple
+        """
+        returns the factors to convert image coordinates into heatmap coordinates
+        :return: (scale_x, scale_y)
+        """
+        heatmap = self._get_heatmap()
+        x1, y1, x2, y2 = self._heatmap_roi
+        return heatmap.shape[1] / float(x2 - x1), heatmap.shape[0] / float(y2 - y1)
+
+    def _get_roi(self, image):
+        # type: (np.array) -> tuple
+        """
+        returns the image region the fcnn runs on, this is the window (if set) or the region below the field boundary
+        :param image: the image
+        :return: (x1, y1, x2, y2) in image coordinates
+        """
+        height, width = image.shape[:2]
+        if self._window is None:
+            return 0, self._get_roi_top(image), width, height
+        x1, y1, x2, y2 = [int(round(value)) for value in self._window]
+        # the network needs a few pixels to work on
+        x1 = min(max(x1, 0), width - 8)
+        y1 = min(max(y1, 0), height - 8)
+        return x1, y1, min(max(x2, x1 + 8), width), min(max(y2, y1 + 8), height)
+
+    def _get_roi_top(self, image):
+        # type: (np.array) -> int
+        """
+        returns the upper y coordinate of the image region the fcnn runs on
+        :param image: the image
+        :return: 0 or the highest point of the field boundary minus the crop margin
+        """
+        if not self._crop_to_field_boundary:
+            return 0
+        roi_top = self._get_field_boundary_top(self._crop_margin)
+        # the network needs a few rows to work on
+        return min(roi_top, image.shape[0] - 8)
+
+    def _get_field_boundary_top(self, y_offset):
+        # type: (int) -> int
+        """
+        returns the highest point of the field boundary in the coordinates of the images of the handler
+        :param y_offset: offset above the field boundary in pixels of the images of the handler
+        :return: y coordinate of the highest point of the field boundary minus the offset
+        """
+        top = int(self._field_boundary_detector.get_upper_bound() * self._field_boundary_scale)
+        return max(0, top - y_offset)
+
+    def _get_input_size(self, image, roi):
+        # type: (np.array, np.array) -> tuple
+        """
+        returns the size of the network input for a region of the image.
+        The full image is scaled to the default input shape of the fcnn,
+        a cropped region keeps the pixel density of the full image multiplied by the crop scale.
+        :param image: the full image
+        :param roi: the image region
+        :return: (width, height) of the network input
+        """
+        if roi.shape[:2] == image.shape[:2] and self._crop_scale == 1.0:
+            return self._fcnn.input_shape[1], self._fcnn.input_shape[0]
+        scale_x = self._fcnn.input_shape[1] / float(image.shape[1]) * self._crop_scale
+        scale_y = self._fcnn.input_shape[0] / float(image.shape[0]) * self._crop_scale
+        return max(4, int(round(roi.shape[1] * scale_x))), max(4, int(round(roi.shape[0] * scale_y)))
+
+    def _get_raw_boxes(self):
+        # type: () -> np.array
+        """
+        finds spots in the binarized heatmap with the configured candidate method
+        :return: int array of shape (n, 4) containing x1, y1, x2, y2 in heatmap coordinates
+        """
         start = cv2.getTickCount()
-        out = self.get_fcnn_output()
+        heatmap = self._get_heatmap()
         end = cv2.getTickCount()
         self._debug_printer.info('Net:' + str((end - start) / cv2.getTickFrequency()), 'fcnn')
         start = cv2.getTickCount()
-        r, out_bin = cv2.threshold(out, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        tuple_candidates = VisionExtensions.findSpots(out_bin, self._pointcloud_stepsize, self._expand_stepsize, self._candidate_refinement_iteration_count)
-        candidates = list()
-        self._debug_printer.info(len(tuple_candidates), 'fcnn')
-        for candidate in tuple_candidates:
-            # calculate final width and height
-            width, height = candidate[0] - candidate[1], candidate[3] - candidate[2]
-            candidates.append(Candidate(candidate[1], candidate[2], width, height))
+        r, out_bin = cv2.threshold(
+            self._get_heatmap_uint8(), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU,
+            dst=self._get_buffer('binary', heatmap.shape, np.uint8))
+        if self._candidate_method == 'components':
+            boxes = self.find_boxes_components(out_bin)
+        else:
+            # the stepsizes are configured in image pixels
+            scale_x, scale_y = self._get_heatmap_scale()
+            scale = (scale_x + scale_y) / 2.0
+            boxes = self.find_boxes_spots(
+                out_bin,
+                max(1, int(round(self._pointcloud_stepsize * scale))),
+                max(1, int(round(self._expand_stepsize * scale))),
+                self._candidate_refinement_iteration_count)
+        self._debug_printer.info(len(boxes), 'fcnn')
         end = cv2.getTickCount()
         self._debug_printer.info('Cluster:' + str((end - start) / cv2.getTickFrequency()), 'fcnn')
-        return candidates
+        return boxes
+
+    @staticmethod
+    def find_boxes_spots(binary_image, pointcloud_stepsize, expand_stepsize, refinement_iteration_count):
+        # type: (np.array, int, int, int) -> np.array
+        """
+        finds boxes by expanding the points of a grid in a binary image (VisionExtensions.findSpots)
+        :param binary_image: np.array of type uint8
+        :param pointcloud_stepsize: distance of the grid points in pixels
+        :param expand_stepsize: step size of the expansion in pixels
+        :param refinement_iteration_count: number of refinement iterations
+        :return: int array of shape (n, 4) containing x1, y1, x2, y2
+        """
+        tuple_candidates = VisionExtensions.findSpots(
+            binary_image, pointcloud_stepsize, expand_stepsize, refinement_iteration_count)
+        # findSpots returns inclusive (rx, lx, uy, ly), the boxes use exclusive lower right corners
+        return np.array([(candidate[1], candidate[2], candidate[0] + 1, candidate[3] + 1)
+                         for candidate in tuple_candidates], dtype=int).reshape(-1, 4)
+
+    @staticmethod
+    def find_boxes_components(binary_image):
+        # type: (np.array) -> np.array
+        """
+        finds the bounding boxes of the 8-connected components of a binary image
+        :param binary_image: np.array of type uint8
+        :return: int array of shape (n, 4) containing x1, y1, x2, y2
+        """
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(binary_image, connectivity=8)
+        # label 0 is the background
+        boxes = stats[1:, :4].astype(int)
+        boxes[:, 2:] += boxes[:, :2]
+        return boxes
 
     def _get_raw_candidates(self):
         """
@@ -258,14 +551,16 @@ class FcnnHandler(CandidateFinder):
         return candidates
 
     def get_debug_image(self):
-        if self._debug:
+        if self._debug and self._image is not None:
             return self.bridge.cv2_to_imgmsg(self.get_fcnn_output(), "mono8")
 
     def get_cropped_msg(self):
+        if self._image is None:
+            return None
         msg = ImageWithRegionOfInterest()
         msg.header.frame_id = 'camera'
-        msg.header.stamp = rospy.get_rostime()
-        field_boundary_top = self._field_boundary_detector.get_upper_bound(y_offset=self._field_boundary_offset)
+        msg.header.stamp = self._image_stamp if self._image_stamp is not None else rospy.get_rostime()
+        field_boundary_top = self._get_field_boundary_top(self._field_boundary_offset)
         image_cropped = self.get_fcnn_output()[field_boundary_top:]  # cut off at field_boundary
         msg.image = self.bridge.cv2_to_imgmsg(image_cropped, "mono8")
         msg.regionOfInterest.x_offset = 0
@@ -0,0 +1,238 @@
+import queue
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import Future
+from .live_fcnn_03 import FcnnModel, load_fcnn
+from .debug import DebugPrinter
+
+# seconds between the checks whether the worker process is still alive, while waiting for its results
+_ALIVE_CHECK_INTERVAL = 1.0
+# seconds the worker process gets to finish its queued batches on shutdown, before it is terminated
+_SHUTDOWN_TIMEOUT = 5.0
+
+
+class SharedFrameRing(object):
+    """
+    SharedFrameRing is a ring of slots in shared memory, which are read and written by several processes without copies.
+    The memory has to be passed to the other processes when they are started.
+    Every slot holds one array of at most slot_size bytes, its shape and type are sent separately.
+    """
+
+    def __init__(self, context, slot_count, slot_size):
+        # type: (multiprocessing.context.BaseContext, int, int) -> None
+        """
+        :param context: multiprocessing context of the processes sharing the ring
+        :param slot_count: number of slots
+        :param slot_size: size of a slot in bytes
+        """
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self._memory = context.RawArray('B', slot_count * slot_size)
+
+    def view(self, slot, shape, dtype):
+        # type: (int, tuple, str) -> np.array
+        """
+        returns the array in a slot, the memory is shared and not copied
+        :param slot: index of the slot
+        :param shape: shape of the array
+        :param dtype: type of the array
+        :return: the array
+        """
+        dtype = np.dtype(dtype)
+        return np.frombuffer(
+            self._memory, dtype=dtype, count=int(np.prod(shape)), offset=slot * self.slot_size).reshape(shape)
+
+    def write(self, slot, images):
+        # type: (int, list) -> tuple
+        """
+        writes images of equal size into a slot
+        :param slot: index of the slot
+        :param images: list or array of images
+        :return: shape and type of the written array, to read it with view
+        """
+        shape = (len(images),) + images[0].shape
+        dtype = images[0].dtype.str
+        if int(np.prod(shape)) * images[0].dtype.itemsize > self.slot_size:
+            raise ValueError('a batch of shape {} does not fit into a slot of {} bytes'.format(shape, self.slot_size))
+        view = self.view(slot, shape, dtype)
+        for index, image in enumerate(images):
+            view[index] = image
+        return shape, dtype
+
+
+class FcnnProcess(FcnnModel):
+    """
+    FcnnProcess runs a fcnn in a separate process, so the network does not compete with the vision for the GIL.
+    It provides the predict and predict_async methods of a FcnnModel, so it can be passed to a FcnnHandler instead of the model.
+
+    The input images and the heatmaps are exchanged in shared memory, only the slot indices are sent between the processes.
+    The worker process is started with 'spawn', so it does not inherit the state of ROS and tensorflow.
+    If the worker process exits unexpectedly, the outstanding and all following predictions fail with a RuntimeError.
+    """
+
+    def __init__(self, backend, load_path, debug_printer, session_options=None, slot_count=3, max_image_size=(1024, 1280)):
+        # type: (str, str, DebugPrinter, dict, int, tuple) -> None
+        """
+        :param backend: backend of the fcnn, see live_fcnn_03.load_fcnn
+        :param load_path: path of the model directory
+        :param debug_printer: debug-printer
+        :param session_options: options of the tensorflow session, see tf_session.create_session
+        :param slot_count: number of batches which can be processed at the same time
+        :param max_image_size: maximal (height, width) of an input image
+        """
+        FcnnModel.__init__(self, debug_printer, session_options)
+        context = multiprocessing.get_context('spawn')
+        pixel_count = max_image_size[0] * max_image_size[1]
+        # bgr images (uint8) or rgb images (float32) as input, float32 heatmaps as output
+        self._inputs = SharedFrameRing(context, slot_count, pixel_count * 3 * 4)
+        self._outputs = SharedFrameRing(context, slot_count, pixel_count * 4)
+        self._requests = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(
+            target=_run_worker,
+            args=(backend, load_path, debug_printer, session_options,
+                  self._inputs, self._outputs, self._requests, self._results))
+        self._process.daemon = True
+        self._process.start()
+
+        # the worker reports the shapes of the model after it is loaded
+        status, message = self._get_result()
+        if status == 'exited':
+            raise RuntimeError('The fcnn worker process exited with code {} while loading the fcnn'.format(message))
+        if status == 'error':
+            self._stop_process()
+            raise RuntimeError('Could not load the fcnn in the worker process: {}'.format(message))
+        self.input_shape, self.output_shape = message
+
+        # the future of the batch in every slot, a slot is reused after its batch is finished
+        self._slot_futures = [None] * slot_count
+        self._next_slot = 0
+        # the error of all predictions after the worker process exited
+        self._error = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._receive_results)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict(self, batch):
+        """
+        Runs the network in the worker process.
+
+        :param batch: list of bgr images (uint8) or of rgb images (float32, values between 0 and 1)
+        :return: np.array of shape (batch size, height, width, 1)
+        """
+        return self.predict_async(batch).result()
+
+    def predict_async(self, batch):
+        """
+        Sends the images to the worker process. Calls are processed one after another in the order they were made.
+
+        :param batch: list of bgr images (uint8) or of rgb images (float32, values between 0 and 1)
+        :return: concurrent.futures.Future of the predict result
+        """
+        while True:
+            with self._lock:
+                if self._error is not None:
+                    future = Future()
+                    future.set_exception(self._error)
+                    return future
+                slot = self._next_slot
+                previous_future = self._slot_futures[slot]
+                if previous_future is None or previous_future.done():
+                    self._next_slot = (slot + 1) % self._inputs.slot_count
+                    future = Future()
+                    self._slot_futures[slot] = future
+                    shape, dtype = self._inputs.write(slot, batch)
+                    self._requests.put((slot, shape, dtype))
+                    return future
+            # wait without the lock until the previous batch in this slot is finished,
+            # the receiving thread needs the lock to fail the batches when the worker process exits
+            previous_future.exception()
+
+    def _get_result(self):
+        """
+        waits for the next result of the worker process
+        :return: the result, ('exited', exit code) if the worker process exited, None after shutdown
+        """
+        while True:
+            try:
+                return self._results.get(timeout=_ALIVE_CHECK_INTERVAL)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    return 'exited', self._process.exitcode
+
+    def _receive_results(self):
+        while True:
+            result = self._get_result()
+            if result is None:
+                return
+            if result[0] == 'exited':
+                self._fail_outstanding(RuntimeError(
+                    'The fcnn worker process exited unexpectedly with code {}'.format(result[1])))
+                return
+            status, slot, message = result
+            future = self._slot_futures[slot]
+            if status == 'error':
+                future.set_exception(RuntimeError('The fcnn failed in the worker process: {}'.format(message)))
+                continue
+            shape, dtype = message
+            # the slot is overwritten by the next batch
+            future.set_result(self._outputs.view(slot, shape, dtype).copy())
+
+    def _fail_outstanding(self, error):
+        """
+        fails the outstanding and all following predictions
+        :param error: the exception of the predictions
+        """
+        with self._lock:
+            if self._error is None:
+                self._error = error
+            for future in self._slot_futures:
+                if future is not None and not future.done():
+                    future.set_exception(error)
+
+    def _stop_process(self):
+        """
+        waits for the worker process to exit and terminates it, if it does not exit in time (e.g. hangs in the fcnn)
+        """
+        self._process.join(_SHUTDOWN_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+
+    def shutdown(self):
+        """
+        stops the worker process and the thread receiving its results
+        """
+        # the worker finishes the queued batches first, their results are received before the sentinel.
+        # A worker which does not finish in time is terminated and its outstanding batches fail.
+        self._requests.put(None)
+        self._stop_process()
+        self._results.put(None)
+        self._thread.join()
+        self._fail_outstanding(RuntimeError('The fcnn worker process was shut down'))
+
+
+def _run_worker(backend, load_path, debug_printer, session_options, inputs, outputs, requests, results):
+    """
+    main function of the worker process, runs the fcnn on the batches written into the input slots
+    """
+    try:
+        fcnn = load_fcnn(backend, load_path, debug_printer, session_options)
+    except Exception as e:
+        results.put(('error', repr(e)))
+        return
+    results.put(('ready', (fcnn.input_shape, fcnn.output_shape)))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        slot, shape, dtype = request
+        try:
+            out = fcnn.predict(inputs.view(slot, shape, dtype))
+            out = np.asarray(out, dtype=np.float32)
+            results.put(('done', slot, outputs.write(slot, out)))
+        except Exception as e:
+            results.put(('error', slot, repr(e)))
@@ -32,7 +32,14 @@ class FieldBoundaryDetector:
         self._debug_printer = debug_printer
         self._runtime_evaluator = runtime_evaluator
         self._used_by_dyn_color_detector = used_by_dyn_color_detector
-        # init config:
+        self.set_config(config)
+
+    def set_config(self, config):
+        # type: (dict) -> None
+        """
+        updates the configuration, the head joint state is kept
+        :param config: the configuration contained in visionparams.yaml
+        """
         self._x_steps = config['field_boundary_finder_horizontal_steps']
         self._y_steps = config['field_boundary_finder_vertical_steps']
         self._roi_height = config['field_boundary_finder_roi_height']
@@ -43,7 +50,7 @@ class FieldBoundaryDetector:
         self._min_precise_pixel = config['field_boundary_finder_min_precision_pix']
         self._head_joint_threshold = config['field_boundary_finder_head_joint_threshold']
         # changes the search method when the FieldBoundaryDetector is used by the dynamic colorspace
-        if used_by_dyn_color_detector:
+        if self._used_by_dyn_color_detector:
             self._search_method = config['dynamic_color_space_field_boundary_finder_search_method']
         else:
             self._search_method = config['field_boundary_finder_search_method']
@@ -608,16 +615,17 @@ class FieldBoundaryDetector:
         footpoint = (candidate[0] + candidate[2] // 2, candidate[1] + candidate[3] + y_offset)
         return self.point_under_field_boundary(footpoint)
 
-    def candidate_under_convex_field_boundary(self, candidate, y_offset=0):
-        # type: (tuple, int) -> bool
+    def candidate_under_convex_field_boundary(self, candidate, y_offset=0, field_boundary=None):
+        # type: (tuple, int, np.array) -> bool
         """
         returns whether the candidate is under the convex field_boundary or not
         :param candidate: the candidate, a tuple (upleft_x, upleft_y, width, height)
         :param y_offset: an offset in y-direction (higher offset allows points in a wider range over the field_boundary)
+        :param field_boundary: full convex field_boundary of another image, None for the current image
         :return: whether the candidate is under the convex field_boundary or not
         """
         footpoint = (candidate[0] + candidate[2] // 2, candidate[1] + candidate[3] + y_offset)
-        return self.point_under_convex_field_boundary(footpoint)
+        return self.point_under_convex_field_boundary(footpoint, field_boundary=field_boundary)
 
     def compute_all(self):
         self.compute_full_convex_field_boundary()
@@ -631,23 +639,40 @@ class FieldBoundaryDetector:
         # type: (list, int) -> list
         return [candidate for candidate in candidates if self.candidate_under_convex_field_boundary(candidate, y_offset)]
 
-    def balls_under_field_boundary(self, balls, y_offset=0):
-        # type: (list, int) -> list
+    def balls_under_field_boundary(self, balls, y_offset=0, scale=1):
+        # type: (list, int, float) -> list
+        """
+        :param balls: list of Candidates
+        :param y_offset: an offset in y-direction
+        :param scale: factor from the coordinates of the balls to the coordinates of the field boundary,
+            e.g. for balls found in an image of another resolution
+        :return: the balls under the field_boundary
+        """
         return [candidate for candidate in balls if self.candidate_under_field_boundary(
-            (candidate.get_upper_left_x(),
-             candidate.get_upper_left_y(),
-             candidate.get_width(),
-             candidate.get_height()),
+            (int(candidate.get_upper_left_x() * scale),
+             int(candidate.get_upper_left_y() * scale),
+             int(candidate.get_width() * scale),
+             int(candidate.get_height() * scale)),
             y_offset)]
 
-    def balls_under_convex_field_boundary(self, balls, y_offset=0):
-        # type: (list, int) -> list
+    def balls_under_convex_field_boundary(self, balls, y_offset=0, scale=1, field_boundary=None):
+        # type: (list, int, float, np.array) -> list
+        """
+        :param balls: list of Candidates
+        :param y_offset: an offset in y-direction
+        :param scale: factor from the coordinates of the balls to the coordinates of the field boundary,
+            e.g. for balls found in an image of another resolution
+        :param field_boundary: full convex field_boundary (see get_full_convex_field_boundary) of the image
+            the balls were found in, None for the current image
+        :return: the balls under the field_boundary
+        """
         return [candidate for candidate in balls if self.candidate_under_convex_field_boundary(
-            (candidate.get_upper_left_x(),
-             candidate.get_upper_left_y(),
-             candidate.get_width(),
-             candidate.get_height()),
-            y_offset)]
+            (int(candidate.get_upper_left_x() * scale),
+             int(candidate.get_upper_left_y() * scale),
+             int(candidate.get_width() * scale),
+             int(candidate.get_height() * scale)),
+            y_offset,
+            field_boundary)]
 
     def point_under_field_boundary(self, point, offset=0):
         # type: (tuple, int) -> bool
@@ -662,18 +687,21 @@ class FieldBoundaryDetector:
             return False
         return point[1] + offset > self.get_full_field_boundary()[point[0]]
 
-    def point_under_convex_field_boundary(self, point, offset=0):
-        # type: (tuple, int) -> bool
+    def point_under_convex_field_boundary(self, point, offset=0, field_boundary=None):
+        # type: (tuple, int, np.array) -> bool
         """
         returns if given coordinate is a point under the convex field_boundary
         :param point: coordinate (x, y) to test
         :param offset: offset of pixels to still be accepted as under the field_boundary. Default is 0.
+        :param field_boundary: full convex field_boundary of another image, None for the current image
         :return a boolean if point is under the convex field_boundary:
         """
-        if not 0 <= point[0] < len(self.get_full_convex_field_boundary()):
+        if field_boundary is None:
+            field_boundary = self.get_full_convex_field_boundary()
+        if not 0 <= point[0] < len(field_boundary):
             rospy.logwarn('point_under_field_boundary got called with an out of bounds field_boundary point')
             return False
-        return point[1] + offset > self.get_full_convex_field_boundary()[point[0]]
+        return point[1] + offset > field_boundary[point[0]]
 
     def get_upper_bound(self, y_offset=0):
         # type: () -> int
@@ -0,0 +1,49 @@
+import threading
+
+
+class FrameCache(object):
+    """
+    FrameCache stores results, which are computed once per frame and used by several modules,
+    e.g. the yolo detections used by the ball and the goalpost detector.
+    Frames are identified by an id like the header stamp of the image, so the image content is never compared.
+    """
+
+    def __init__(self):
+        self._frame_id = None
+        self._results = dict()
+        # the vision computes modules in parallel threads
+        self._lock = threading.RLock()
+
+    def set_frame(self, frame_id):
+        # type: (object) -> bool
+        """
+        sets the id of the current frame. A new id drops the results of the previous frame, the same id keeps them.
+        :param frame_id: id of the frame, e.g. the header stamp of the image
+        :return: whether the frame is new
+        """
+        with self._lock:
+            if frame_id == self._frame_id and frame_id is not None:
+                return False
+            self._frame_id = frame_id
+            self._results = dict()
+            return True
+
+    def get_frame_id(self):
+        # type: () -> object
+        """
+        returns the id of the current frame
+        """
+        return self._frame_id
+
+    def get(self, key, compute):
+        # type: (str, callable) -> object
+        """
+        returns the result of the current frame stored under the key, it is computed on the first request
+        :param key: name of the result
+        :param compute: function without arguments computing the result
+        :return: the result
+        """
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = compute()
+            return self._results[key]
@@ -0,0 +1,87 @@
+import threading
+import traceback
+import rospy
+
+
+class FrameMailbox(object):
+    """
+    FrameMailbox decouples the processing of images from the ROS subscriber.
+
+    The subscriber callback only puts the message into a single slot, an unprocessed message in the slot is replaced.
+    A worker thread processes the message in the slot, so it always works on the newest image,
+    however long the processing of the previous image took.
+    The number of replaced messages and the age of the images at the start of their processing are recorded,
+    see get_statistics. Messages the handler does not process (e.g. because they are too old) are reported with reject.
+    """
+
+    def __init__(self, handler):
+        # type: (callable) -> None
+        """
+        :param handler: function processing a message, called in the worker thread
+        """
+        self._handler = handler
+        self._message = None
+        self._condition = threading.Condition()
+        self._received_count = 0
+        self._processed_count = 0
+        self._dropped_count = 0
+        self._rejected_count = 0
+        self._age = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, message):
+        """
+        puts a message into the slot, used as subscriber callback
+        :param message: message with a header
+        """
+        with self._condition:
+            if self._message is not None:
+                self._dropped_count += 1
+            self._message = message
+            self._received_count += 1
+            self._condition.notify()
+
+    def reject(self):
+        """
+        counts the current message as dropped instead of processed, called by the handler for messages it skips
+        """
+        with self._condition:
+            self._processed_count -= 1
+            self._rejected_count += 1
+            self._dropped_count += 1
+
+    def get_statistics(self):
+        # type: () -> dict
+        """
+        returns the statistics of the mailbox:
+        received: number of received messages
+        processed: number of processed messages
+        dropped: number of messages replaced before they were processed or rejected by the handler
+        rejected: number of messages rejected by the handler
+        age: age of the current (or last) message at the start of its processing in seconds
+        """
+        with self._condition:
+            return {
+                'received': self._received_count,
+                'processed': self._processed_count,
+                'dropped': self._dropped_count,
+                'rejected': self._rejected_count,
+                'age': self._age,
+            }
+
+    def _run(self):
+        while not rospy.is_shutdown():
+            with self._condition:
+                while self._message is None:
+                    self._condition.wait()
+                message = self._message
+                self._message = None
+                self._age = (rospy.get_rostime() - message.header.stamp).to_sec()
+                self._processed_count += 1
+            try:
+                self._handler(message)
+            except Exception:
+                # the worker thread has to survive errors in the processing of a single image
+                rospy.logerr('Error while processing a message: {}'.format(traceback.format_exc()))
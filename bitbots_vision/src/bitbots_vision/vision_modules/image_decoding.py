@@ -0,0 +1,183 @@
+import cv2
+import numpy as np
+from cv_bridge import CvBridge
+from sensor_msgs.msg import Image, CompressedImage
+
+
+# encodings converted with opencv, other encodings are converted by the CvBridge
+_CHANNELS = {
+    'bgr8': 3,
+    'rgb8': 3,
+    'bgra8': 4,
+    'rgba8': 4,
+    'mono8': 1,
+    'yuv422': 2,
+    'yuv422_yuy2': 2,
+    'bayer_rggb8': 1,
+    'bayer_bggr8': 1,
+    'bayer_gbrg8': 1,
+    'bayer_grbg8': 1,
+}
+# the names of the bayer patterns differ between ROS and opencv
+_CONVERSIONS = {
+    'rgb8': cv2.COLOR_RGB2BGR,
+    'bgra8': cv2.COLOR_BGRA2BGR,
+    'rgba8': cv2.COLOR_RGBA2BGR,
+    'mono8': cv2.COLOR_GRAY2BGR,
+    'yuv422': cv2.COLOR_YUV2BGR_UYVY,
+    'yuv422_yuy2': cv2.COLOR_YUV2BGR_YUY2,
+    'bayer_rggb8': cv2.COLOR_BayerBG2BGR,
+    'bayer_bggr8': cv2.COLOR_BayerRG2BGR,
+    'bayer_gbrg8': cv2.COLOR_BayerGR2BGR,
+    'bayer_grbg8': cv2.COLOR_BayerGB2BGR,
+}
+# index of the luma (y) in the two channels of the yuv422 encodings
+_LUMA_CHANNEL = {
+    'yuv422': 1,  # u y0 v y1
+    'yuv422_yuy2': 0,  # y0 u y1 v
+}
+
+# decoding flags of opencv for the reductions of the resolution, jpeg images are decoded directly at the reduced size
+_REDUCED_DECODING_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# offsets of a yuv value and its neighbours, the yuv values decoded into a bgr color are next to each other
+_YUV_NEIGHBOURHOOD = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij')).reshape(3, -1).T
+
+_bridge = None
+_yuv_to_bgr_table = None
+
+
+def image_msg_view(image_msg):
+    # type: (Image) -> np.array
+    """
+    Returns the pixels of an 8 bit Image-message as np.array without copying them.
+    The array is read-only, because it shares the memory with the message.
+
+    :param image_msg: Image-message with one of the encodings bgr8, rgb8, bgra8, rgba8 or mono8
+    :return: read-only array of shape (height, width, channels), (height, width) for mono8
+    """
+    channels = _CHANNELS[image_msg.encoding]
+    data = np.frombuffer(image_msg.data, dtype=np.uint8)
+    if channels == 1:
+        shape = (image_msg.height, image_msg.width)
+        strides = (image_msg.step, 1)
+    else:
+        shape = (image_msg.height, image_msg.width, channels)
+        strides = (image_msg.step, channels, 1)
+    # the step may contain padding at the end of every row
+    return np.lib.stride_tricks.as_strided(data, shape=shape, strides=strides, writeable=False)
+
+
+def imgmsg_to_bgr(image_msg):
+    # type: (Image) -> np.array
+    """
+    Converts an Image-message into a bgr image.
+    A bgr8 message is not copied, the returned image is a read-only view of the message data.
+    Other encodings are converted into a new image.
+
+    :param image_msg: Image-message
+    :return: bgr image (uint8)
+    """
+    if image_msg.encoding == 'bgr8':
+        return image_msg_view(image_msg)
+    if image_msg.encoding in _CONVERSIONS:
+        return cv2.cvtColor(image_msg_view(image_msg), _CONVERSIONS[image_msg.encoding])
+    global _bridge
+    if _bridge is None:
+        _bridge = CvBridge()
+    return _bridge.imgmsg_to_cv2(image_msg, 'bgr8')
+
+
+def compressed_imgmsg_to_bgr(image_msg, reduction=1):
+    # type: (CompressedImage, int) -> np.array
+    """
+    Decodes a CompressedImage-message into a bgr image.
+    Jpeg images are decoded directly at the reduced resolution, which is faster than decoding and resizing them.
+
+    :param image_msg: CompressedImage-message, e.g. jpeg or png
+    :param reduction: the width and height of the image are divided by this factor (1, 2, 4 or 8)
+    :return: bgr image (uint8)
+    """
+    image = cv2.imdecode(np.frombuffer(image_msg.data, dtype=np.uint8), _REDUCED_DECODING_FLAGS[reduction])
+    if image is None:
+        raise ValueError('Could not decode the compressed image of format {}'.format(image_msg.format))
+    return image
+
+
+def is_yuv422(image_msg):
+    # type: (Image) -> bool
+    """
+    returns whether the Image-message is encoded in one of the packed yuv422 encodings
+    """
+    return image_msg.encoding in _LUMA_CHANNEL
+
+
+def imgmsg_to_yuv(image_msg):
+    # type: (Image) -> np.array
+    """
+    Converts a yuv422 Image-message into a yuv image with three channels.
+    The chroma of every pair of pixels is used for both pixels, the values are not converted.
+
+    :param image_msg: Image-message with the encoding yuv422 or yuv422_yuy2
+    :return: yuv image (uint8) of shape (height, width, 3)
+    """
+    packed = image_msg_view(image_msg)
+    luma_channel = _LUMA_CHANNEL[image_msg.encoding]
+    chroma = packed[:, :, 1 - luma_channel]
+    yuv = np.empty((image_msg.height, image_msg.width, 3), dtype=np.uint8)
+    yuv[:, :, 0] = packed[:, :, luma_channel]
+    # the chroma alternates between u (even pixels) and v (odd pixels)
+    yuv[:, 0::2, 1] = chroma[:, 0::2]
+    yuv[:, 1::2, 1] = chroma[:, 0::2]
+    yuv[:, 0::2, 2] = chroma[:, 1::2]
+    yuv[:, 1::2, 2] = chroma[:, 1::2]
+    return yuv
+
+
+def yuv_to_bgr_table():
+    # type: () -> np.array
+    """
+    Returns the bgr color of every yuv value, converted like the yuv422 Image-messages.
+    It is used to create color spaces for yuv images from color spaces for bgr images.
+    The table is created on the first call, it has a size of 48 MB.
+
+    :return: array of shape (256, 256, 256, 3) indexed by y, u and v
+    """
+    global _yuv_to_bgr_table
+    if _yuv_to_bgr_table is None:
+        values = np.arange(256 ** 3, dtype=np.uint32)
+        # every yuv value is written as a pair of pixels with the same color into an uyvy image
+        packed = np.empty((256 ** 3, 2, 2), dtype=np.uint8)
+        packed[:, :, 1] = (values >> 16)[:, None]
+        packed[:, 0, 0] = (values >> 8) & 255
+        packed[:, 1, 0] = values & 255
+        packed = packed.reshape(4096, 8192, 2)
+        bgr = cv2.cvtColor(packed, cv2.COLOR_YUV2BGR_UYVY)[:, 0::2]
+        _yuv_to_bgr_table = np.ascontiguousarray(bgr).reshape(256, 256, 256, 3)
+    return _yuv_to_bgr_table
+
+
+def bgr_colors_to_yuv(colors):
+    # type: (np.array) -> np.array
+    """
+    Returns the yuv values, which are decoded into one of the bgr colors (see yuv_to_bgr_table).
+    The yuv values are estimated with the inverse of the conversion of opencv (BT.601 video range),
+    the values around the estimate are checked with the table.
+
+    :param colors: array of shape (n, 3) containing b, g and r
+    :return: array of shape (m, 3) containing y, u and v
+    """
+    colors = np.asarray(colors, dtype=np.int32).reshape(-1, 3)
+    b, g, r = colors[:, 0], colors[:, 1], colors[:, 2]
+    estimate = np.stack([
+        16 + 0.257 * r + 0.504 * g + 0.098 * b,
+        128 - 0.148 * r - 0.291 * g + 0.439 * b,
+        128 + 0.439 * r - 0.368 * g - 0.071 * b], axis=1)
+    candidates = np.clip(np.round(estimate).astype(np.int32)[:, None, :] + _YUV_NEIGHBOURHOOD, 0, 255)
+    decoded = yuv_to_bgr_table()[candidates[..., 0], candidates[..., 1], candidates[..., 2]]
+    return candidates[np.all(decoded == colors[:, None, :], axis=2)]
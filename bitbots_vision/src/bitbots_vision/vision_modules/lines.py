@@ -18,14 +18,37 @@ class LineDetector:
         self._linepoints = None
         # self._nonlinepoints = None  # these are points that are not found on a line, helpful for localisation
         self._linesegments = None
+        self._candidates = list()
         self._white_detector = white_detector
         self._field_color_detector = field_color_detector
         self._field_boundary_detector = field_boundary_detector
         self._debug_printer = debug_printer
-        # init config
+        self.set_config(config)
+
+    def set_config(self, config):
+        # type: (dict) -> None
+        """
+        updates the configuration
+        :param config: the configuration contained in visionparams.yaml
+        """
         self._field_boundary_offset = config['line_detector_field_boundary_offset']
         self._linepoints_range = config['line_detector_linepoints_range']
         self._blur_kernel_size = config['line_detector_blur_kernel_size']
+        self._hough_threshold = config['line_detector_hough_threshold']
+        self._hough_min_line_length = config['line_detector_hough_min_line_length']
+        self._hough_max_line_gap = config['line_detector_hough_max_line_gap']
+        # the method and its detector are replaced together, the current image may still be processed
+        segment_method = config['line_detector_segment_method']
+        line_segment_detector = None
+        if segment_method == 'lsd':
+            try:
+                line_segment_detector = cv2.createLineSegmentDetector()
+            except cv2.error:
+                # LSD is not available in every OpenCV version due to licensing issues
+                self._debug_printer.error('LSD is not available in this OpenCV version, using hough instead', 'lines')
+                segment_method = 'hough'
+        self._line_segment_detector = line_segment_detector
+        self._segment_method = segment_method
 
     def set_image(self, image):
         self._image = image
@@ -33,10 +56,16 @@ class LineDetector:
         self._linepoints = None
         # self._nonlinepoints = None
         self._linesegments = None
+        self._candidates = list()
 
     def set_candidates(self, candidates):
         # type: (list) -> None
+        """
+        sets the candidates (e.g. balls) whose area is excluded from the line segments
+        :param candidates: list of Candidate
+        """
         self._candidates = candidates
+        self._linesegments = None
 
     def compute_linepoints(self):
         # if self._linepoints is None or self._nonlinepoints is None:
@@ -67,38 +96,85 @@ class LineDetector:
         # return self._nonlinepoints
 
     def get_linesegments(self):
+        # type: () -> list
+        """
+        returns the line segments below the field_boundary which do not touch any of the candidates
+        :return: list of (x1, y1, x2, y2) tuples
+        """
+        self.compute_linesegments()
+        return self._linesegments
 
-        img = self._white_detector.mask_image(self._get_preprocessed_image())
-        lines = cv2.HoughLinesP(img,
-                                1,
-                                math.pi / 180,
-                                80,
-                                30,
-                                minLineLength=10)
-        self._linesegments = []
+    def compute_linesegments(self):
+        # type: () -> None
+        """
+        finds line segments in the white mask of the region below the field_boundary
+        and filters them with the candidates and the field_boundary
+        """
+        if self._linesegments is None:
+            # only the region below the highest point of the field_boundary has to be searched
+            upper_bound = self._field_boundary_detector.get_upper_bound(self._field_boundary_offset)
+            white_masked_image = self._white_detector.mask_image(self._get_preprocessed_image()[upper_bound:])
+            segments = self._find_segments(white_masked_image)
+            if segments.size == 0:
+                self._linesegments = list()
+                return
+            # map the segments back to image coordinates
+            segments[:, [1, 3]] += upper_bound
+            segments = segments[self._segments_under_field_boundary(segments)]
+            segments = segments[np.logical_not(self._segments_in_candidates(segments))]
+            self._linesegments = [tuple(segment) for segment in segments.tolist()]
+
+    def _find_segments(self, white_masked_image):
+        # type: (np.array) -> np.array
+        """
+        runs the configured segment detector on a binary image
+        :param white_masked_image: binary image of white pixels
+        :return: int array of shape (n, 4) containing x1, y1, x2, y2
+        """
+        if self._segment_method == 'lsd':
+            lines = self._line_segment_detector.detect(white_masked_image)[0]
+        else:
+            lines = cv2.HoughLinesP(white_masked_image,
+                                    1,
+                                    math.pi / 180,
+                                    self._hough_threshold,
+                                    minLineLength=self._hough_min_line_length,
+                                    maxLineGap=self._hough_max_line_gap)
         if lines is None:
-            return self._linesegments
-        for l in lines:
-            for x1, y1, x2, y2 in l:
-                # check if start or end is in any of the candidates
-                in_candidate = False
-                for candidate in self._candidates:
-                    if candidate and (
-                            candidate.point_in_candidate((x1, x2)) or
-                            candidate.point_in_candidate((x2, y2))):
-                        in_candidate = True
-                        break
-
-                # check if start and end is under field_boundary
-                under_field_boundary = self._field_boundary_detector.point_under_field_boundary(
-                    (x1, y1), self._field_boundary_offset) and \
-                                self._field_boundary_detector.point_under_field_boundary(
-                                    (x1, y1), self._field_boundary_offset)
-
-                if not in_candidate and under_field_boundary:
-                    self._linesegments.append((x1, y1, x2, y2))
-            
-        return self._linesegments
+            return np.empty((0, 4), dtype=int)
+        return np.round(lines.reshape(-1, 4)).astype(int)
+
+    def _segments_under_field_boundary(self, segments):
+        # type: (np.array) -> np.array
+        """
+        checks whether start and end point of the segments are under the field_boundary
+        :param segments: int array of shape (n, 4) containing x1, y1, x2, y2
+        :return: boolean array of shape (n,)
+        """
+        full_field_boundary = np.asarray(self._field_boundary_detector.get_full_field_boundary())
+        x = np.clip(segments[:, [0, 2]], 0, len(full_field_boundary) - 1)
+        y = segments[:, [1, 3]]
+        return np.all(y + self._field_boundary_offset > full_field_boundary[x], axis=1)
+
+    def _segments_in_candidates(self, segments):
+        # type: (np.array) -> np.array
+        """
+        checks whether start or end point of the segments lies in any of the candidates
+        :param segments: int array of shape (n, 4) containing x1, y1, x2, y2
+        :return: boolean array of shape (n,)
+        """
+        boxes = np.array([(candidate.get_upper_left_x(),
+                           candidate.get_upper_left_y(),
+                           candidate.get_lower_right_x(),
+                           candidate.get_lower_right_y()) for candidate in self._candidates if candidate])
+        if boxes.size == 0:
+            return np.zeros(len(segments), dtype=bool)
+        in_candidate = np.zeros(len(segments), dtype=bool)
+        for x, y in ((segments[:, 0], segments[:, 1]), (segments[:, 2], segments[:, 3])):
+            # compare every point with every box, shape (n, m)
+            in_candidate |= np.any((boxes[:, 0] <= x[:, None]) & (x[:, None] <= boxes[:, 2]) &
+                                   (boxes[:, 1] <= y[:, None]) & (y[:, None] <= boxes[:, 3]), axis=1)
+        return in_candidate
 
     def _get_preprocessed_image(self):
         if self._preprocessed_image is None:
@@ -3,21 +3,24 @@ import numpy as np
 import rospy
 import sys, os
 from .debug import DebugPrinter
+from .tf_session import create_session
 
 
 class LiveClassifier(object):
 
-    def __init__(self, load_path, debug_printer):
+    def __init__(self, load_path, debug_printer, session_options=None):
         """
         Constructor
         
         :param load_path: path (str) where data should be loaded from
+        :param session_options: threading options of the session, see tf_session.create_session
         """
         if load_path[-1] != "/":
             load_path += "/"
         self.model_load_path = load_path + "model"
         self.load_path = load_path
         self._debug_printer = debug_printer
+        self._session_options = session_options
 
         self.input_shape = (40, 40, 3)
 
@@ -34,7 +37,7 @@ class LiveClassifier(object):
         return out
 
     def initialize_network(self):
-        self.session = tf.Session()
+        self.session = create_session(self._session_options)
         self.init = tf.global_variables_initializer()
         self.session.run(self.init)
         self.saver = tf.train.Saver()
@@ -1,58 +1,185 @@
 import os
+import abc
+import cv2
+import numpy as np
 import tensorflow as tf
+from concurrent.futures import ThreadPoolExecutor
 import rospy
 from .debug import DebugPrinter
+from .tf_session import create_session
 
 
-class FCNN03:
+FROZEN_GRAPH_FILE = "frozen_graph.pb"
+INPUT_NODE = "placeholders/X"
+OUTPUT_NODE = "conv/conv18/output"
+QUANTIZED_MODEL_FILE = "fcnn_int8.tflite"
 
-    def __init__(self, load_path, debug_printer):
-        rospy.loginfo("setting up ball detection: FCNN03")
-        self._debug_printer = debug_printer
 
-        self._load_path = os.path.join(load_path, "model_final")
+class FcnnModel(object):
+    """
+    FcnnModel is the abstract super-class of the different backends running the ball fcnn.
+    """
 
+    def __init__(self, debug_printer, session_options=None):
+        self._debug_printer = debug_printer
+        self._session_options = session_options
+
+        # the default shape for a full image, the network is fully convolutional and accepts other sizes too
         self.input_shape = (150, 200, 3)  # y, x, z
         self.output_shape = (150, 200, 1)  # y, x, z
 
-        # placeholders
-        with tf.variable_scope("placeholders"):
-            self._keep_prob = tf.placeholder("float", name="keep_prob")
-            self.X = tf.placeholder(
-                tf.float32,
-                shape=[
-                    None,
-                    self.input_shape[0],
-                    self.input_shape[1],
-                    self.input_shape[2]],
-                name="X")
-            self.Y = tf.placeholder(
-                tf.float32,
-                shape=[
-                    None,
-                    self.output_shape[0],
-                    self.output_shape[1],
-                    self.output_shape[2]],
-                name="Y")
-
-        # create network
-        self._fcnn_out, self._fcnn_logits = self._fcnn_model()
-
-        # init network & load weights
-        self._initialize_network()
+        # runs predict_async calls, created on first use
+        self._executor = None
+
+    @abc.abstractmethod
+    def predict(self, batch):
+        """
+        Runs the network on a batch of images of equal size.
+        The output has the same height and width as the input.
+
+        :param batch: list of bgr images (uint8) or of rgb images (float32, values between 0 and 1)
+        :return: np.array of shape (batch size, height, width, 1)
+        """
+        raise NotImplementedError
+
+    def predict_async(self, batch):
+        """
+        Runs predict in a background thread. Calls are processed one after another in the order they were made.
+        The session releases the GIL, so the calling thread can continue e.g. with the next preprocessing.
+
+        :param batch: list of bgr images (uint8) or of rgb images (float32, values between 0 and 1)
+        :return: concurrent.futures.Future of the predict result
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor.submit(self.predict, batch)
+
+    @staticmethod
+    def _normalize(batch):
+        """
+        converts bgr images (uint8) into the rgb images (float32, values between 0 and 1) the network expects,
+        for backends without the conversion in their graph
+        """
+        if batch[0].dtype != np.uint8:
+            return batch
+        return [cv2.cvtColor(image, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0 for image in batch]
+
+
+def load_fcnn(backend, load_path, debug_printer, session_options=None):
+    # type: (str, str, DebugPrinter, dict) -> FcnnModel
+    """
+    Loads the ball fcnn with the given backend.
+
+    :param backend: 'tensorflow', 'frozen' or 'quantized'
+    :param load_path: path of the model directory
+    :param debug_printer: debug-printer
+    :param session_options: options of the tensorflow session, see tf_session.create_session
+    :return: the fcnn
+    """
+    if backend == 'frozen':
+        return FrozenFCNN03(load_path, debug_printer, session_options)
+    if backend == 'quantized':
+        return QuantizedFCNN03(load_path, debug_printer, session_options)
+    return FCNN03(load_path, debug_printer, session_options=session_options)
+
+
+class FCNN03(FcnnModel):
+
+    def __init__(self, load_path, debug_printer, use_dropout=True, session_options=None):
+        """
+        Builds the FCNN03 graph and restores the weights from a checkpoint.
+
+        :param load_path: path of the model folder
+        :param debug_printer: debug-printer
+        :param use_dropout: False builds the graph without dropout operations, e.g. for exporting
+        :param session_options: threading options of the session, see tf_session.create_session
+        """
+        super(FCNN03, self).__init__(debug_printer, session_options)
+        rospy.loginfo("setting up ball detection: FCNN03")
+
+        self._load_path = os.path.join(load_path, "model_final")
+        self._use_dropout = use_dropout
+
+        # every instance has its own graph, so the network can be built again, e.g. with other session options
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            # placeholders
+            with tf.variable_scope("placeholders"):
+                self._keep_prob = tf.placeholder("float", name="keep_prob")
+                # bgr images as they come from the camera, converted to normalized rgb in the graph
+                self.X_bgr = tf.placeholder(
+                    tf.uint8,
+                    shape=[
+                        None,
+                        None,
+                        None,
+                        self.input_shape[2]],
+                    name="X_bgr")
+                # feeding X directly skips the conversion
+                self.X = tf.placeholder_with_default(
+                    tf.reverse(tf.cast(self.X_bgr, tf.float32) / 255.0, axis=[3]),
+                    shape=[
+                        None,
+                        None,
+                        None,
+                        self.input_shape[2]],
+                    name="X")
+                self.Y = tf.placeholder(
+                    tf.float32,
+                    shape=[
+                        None,
+                        None,
+                        None,
+                        self.output_shape[2]],
+                    name="Y")
+
+            # create network
+            self._fcnn_out, self._fcnn_logits = self._fcnn_model()
+
+            # init network & load weights
+            self._initialize_network()
 
 
     def predict(self, batch):
-        res = self.session.run(self._fcnn_out,
-                                feed_dict={self.X: batch, self._keep_prob: 1.0})
+        if batch[0].dtype == np.uint8:
+            feed_dict = {self.X_bgr: batch, self._keep_prob: 1.0}
+        else:
+            feed_dict = {self.X: batch, self._keep_prob: 1.0}
+        res = self.session.run(self._fcnn_out, feed_dict=feed_dict)
 
         return res
 
+    def export_frozen_graph(self, output_path):
+        """
+        Writes the network with its weights as constants into a single graph file.
+        Constant operations are folded and the batch normalizations are merged into the convolutions.
+        The network should be built without dropout.
+
+        :param output_path: path of the .pb file
+        """
+        from tensorflow.tools.graph_transforms import TransformGraph
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            self.session, self.session.graph.as_graph_def(), [OUTPUT_NODE])
+        graph_def = TransformGraph(
+            graph_def,
+            [INPUT_NODE],
+            [OUTPUT_NODE],
+            ['strip_unused_nodes',
+             'remove_nodes(op=Identity)',
+             'fold_constants(ignore_errors=true)',
+             'fold_batch_norms',
+             'fold_old_batch_norms'])
+        with tf.gfile.GFile(output_path, "wb") as f:
+            f.write(graph_def.SerializeToString())
+        rospy.loginfo("exported frozen graph to '{}'".format(output_path))
+
+    def _dropout(self, out):
+        if not self._use_dropout:
+            return out
+        return tf.nn.dropout(out, keep_prob=self._keep_prob)
 
     def _initialize_network(self):
-        config = tf.ConfigProto()
-        config.gpu_options.allow_growth = True
-        self.session = tf.Session(config=config)
+        self.session = create_session(self._session_options, self._graph)
         self.init = tf.global_variables_initializer()
         self.session.run(self.init)
         self.saver = tf.train.Saver()
@@ -72,7 +199,7 @@ class FCNN03:
                 out = tf.layers.conv2d(self.X, 16, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
                 before_maxpool1 = out
                 out = tf.layers.max_pooling2d(out, [2, 2], strides=[2, 2], padding="same")
                 maxpool1 = out
@@ -82,14 +209,14 @@ class FCNN03:
                 out = tf.layers.conv2d(out, 32, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("conv3"):
                 # 75x100x16
                 out = tf.layers.conv2d(out, 32, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("concat1"):
                 # 75x100x16
@@ -104,14 +231,14 @@ class FCNN03:
                 out = tf.layers.conv2d(out, 64, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("conv5"):
                 # 38x50x32
                 out = tf.layers.conv2d(out, 64, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("concat2"):
                 out = tf.concat([out, maxpool2], 3)
@@ -123,7 +250,7 @@ class FCNN03:
                 out = tf.layers.conv2d(out, 128, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
                 # 38x50x64
 
             with tf.variable_scope("conv7"):
@@ -131,7 +258,7 @@ class FCNN03:
                 out = tf.layers.conv2d(out, 128, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
                 # 38x50x64
 
 
@@ -140,7 +267,7 @@ class FCNN03:
             #################
             with tf.variable_scope("concat4"):
                 # 38x50x64
-                out = tf.image.resize_images(out, [75, 100], tf.image.ResizeMethod.BILINEAR)
+                out = tf.image.resize_images(out, tf.shape(concat1)[1:3], tf.image.ResizeMethod.BILINEAR)
                 # 75x100x64
                 out = tf.concat([out, concat1], 3)
                 # 75x100x(64+64)
@@ -150,25 +277,25 @@ class FCNN03:
                 out = tf.layers.conv2d(out, 64, [1, 1], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("conv14"):
                 # 75x100x64
                 out = tf.layers.conv2d(out, 32, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("conv15"):
                 # 75x100x32
                 out = tf.layers.conv2d(out, 32, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("concat5"):
                 # 75x100x32
-                out = tf.image.resize_images(out, [150, 200], tf.image.ResizeMethod.BILINEAR)
+                out = tf.image.resize_images(out, tf.shape(before_maxpool1)[1:3], tf.image.ResizeMethod.BILINEAR)
                 # 150x200x32
                 out = tf.concat([out, before_maxpool1], 3)
                 # 150x200x(32+32)
@@ -178,23 +305,151 @@ class FCNN03:
                 out = tf.layers.conv2d(out, 16, [1, 1], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("conv17"):
                 # 150x200x16
                 out = tf.layers.conv2d(out, 16, [3, 3], strides=[1, 1], padding="same")
                 out = tf.layers.batch_normalization(out)
                 out = tf.nn.relu(out)
-                out = tf.nn.dropout(out, keep_prob=self._keep_prob)
+                out = self._dropout(out)
 
             with tf.variable_scope("conv18"):
                 # 150x200x16
                 out = tf.layers.conv2d(out, 1, [3, 3], strides=[1, 1], padding="same")
                 # out = tf.layers.batch_normalization(out)
                 logits = out
-                out = tf.maximum(tf.minimum(out, 1.0), 0.0)
+                out = tf.maximum(tf.minimum(out, 1.0), 0.0, name="output")
                 # 150x200x1
 
         return out, logits
 
 
+class FrozenFCNN03(FcnnModel):
+    """
+    Runs a FCNN03 graph exported with FCNN03.export_frozen_graph.
+    Compared to FCNN03, the graph is not built in python and contains no dropout and no separate batch normalizations.
+    """
+
+    def __init__(self, load_path, debug_printer, session_options=None):
+        super(FrozenFCNN03, self).__init__(debug_printer, session_options)
+        rospy.loginfo("setting up ball detection: FrozenFCNN03")
+
+        graph_path = os.path.join(load_path, FROZEN_GRAPH_FILE)
+        rospy.loginfo("loading frozen graph from '{}'...".format(graph_path))
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(graph_path, "rb") as f:
+            graph_def.ParseFromString(f.read())
+
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        self.X = self._graph.get_tensor_by_name(INPUT_NODE + ":0")
+        self._fcnn_out = self._graph.get_tensor_by_name(OUTPUT_NODE + ":0")
+
+        self.session = create_session(self._session_options, self._graph)
+        rospy.loginfo("loaded successfully.")
+
+    def predict(self, batch):
+        return self.session.run(self._fcnn_out, feed_dict={self.X: self._normalize(batch)})
+
+
+class QuantizedFCNN03(FcnnModel):
+    """
+    Runs an int8 quantized FCNN03 created with QuantizedFCNN03.convert using the tensorflow lite interpreter.
+    The input tensor of the interpreter is resized to the size of the images, e.g. of a crop or a window.
+    Models whose layers were converted for a fixed input shape can not be resized,
+    their images are resized to the converted shape and the outputs are resized back.
+    Of the session options, only intra_op_threads is used, as the number of threads of the interpreter.
+    """
+
+    def __init__(self, load_path, debug_printer, session_options=None):
+        super(QuantizedFCNN03, self).__init__(debug_printer, session_options)
+        rospy.loginfo("setting up ball detection: QuantizedFCNN03")
+
+        model_path = os.path.join(load_path, QUANTIZED_MODEL_FILE)
+        rospy.loginfo("loading quantized model from '{}'...".format(model_path))
+        # 0 threads lets the interpreter choose, like in the tensorflow session
+        num_threads = (session_options or {}).get('intra_op_threads', 0) or None
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input_details = self._interpreter.get_input_details()[0]
+        self._output_details = self._interpreter.get_output_details()[0]
+        self._interpreter.allocate_tensors()
+        self.input_shape = tuple(self._input_details['shape'][1:])
+        self.output_shape = tuple(self._output_details['shape'][1:])
+        # shape of the allocated input tensor (batch size, y, x, z)
+        self._allocated_shape = tuple(self._input_details['shape'])
+        # set, when the model can not run on other sizes than the converted one
+        self._fixed_input_shape = False
+        rospy.loginfo("loaded successfully.")
+
+    @staticmethod
+    def convert(load_path, calibration_images, input_shape=(150, 200, 3), output_path=None):
+        """
+        Converts the frozen graph of a model (see FCNN03.export_frozen_graph) into an int8 quantized model.
+        The ranges of the activations are calibrated on the given images.
+
+        :param load_path: path of the model folder containing the frozen graph
+        :param calibration_images: list of preprocessed images (rgb, float32, values between 0 and 1) of the input shape
+        :param input_shape: input shape of the quantized model (y, x, z)
+        :param output_path: path of the quantized model, defaults to QUANTIZED_MODEL_FILE in the model folder
+        :return: the path of the quantized model
+        """
+        if output_path is None:
+            output_path = os.path.join(load_path, QUANTIZED_MODEL_FILE)
+
+        def representative_dataset():
+            for image in calibration_images:
+                yield [np.expand_dims(image, axis=0).astype(np.float32)]
+
+        converter = tf.lite.TFLiteConverter.from_frozen_graph(
+            os.path.join(load_path, FROZEN_GRAPH_FILE),
+            [INPUT_NODE],
+            [OUTPUT_NODE],
+            input_shapes={INPUT_NODE: [1] + list(input_shape)})
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        with open(output_path, "wb") as f:
+            f.write(converter.convert())
+        return output_path
+
+    def predict(self, batch):
+        batch = self._normalize(batch)
+        height, width = batch[0].shape[:2]
+        if self._fixed_input_shape:
+            shape = (len(batch),) + self.input_shape
+        else:
+            shape = (len(batch),) + batch[0].shape
+        if shape != self._allocated_shape:
+            self._allocate(shape)
+        model_height, model_width = self.input_shape[:2]
+        resize = self._fixed_input_shape and (height, width) != (model_height, model_width)
+        if resize:
+            batch = [cv2.resize(image, (model_width, model_height)) for image in batch]
+        self._interpreter.set_tensor(self._input_details['index'], np.asarray(batch, dtype=np.float32))
+        self._interpreter.invoke()
+        out = self._interpreter.get_tensor(self._output_details['index'])
+        if resize:
+            out = np.array([cv2.resize(heatmap, (width, height)) for heatmap in out])
+            out = out.reshape(out.shape[0], height, width, 1)
+        return out
+
+    def _allocate(self, shape):
+        """
+        Resizes the input tensor of the interpreter to the given shape.
+        If the model does not support the shape, it falls back to the converted input shape.
+
+        :param shape: shape of the input (batch size, y, x, z)
+        """
+        try:
+            self._interpreter.resize_tensor_input(self._input_details['index'], list(shape))
+            self._interpreter.allocate_tensors()
+            self._allocated_shape = shape
+        except (RuntimeError, ValueError) as e:
+            if self._fixed_input_shape:
+                raise
+            rospy.logwarn("The quantized fcnn can not run on images of size {}x{}, they are resized to the "
+                          "converted size {}x{}, which distorts crops and windows: {}".format(
+                              shape[2], shape[1], self.input_shape[1], self.input_shape[0], e))
+            self._fixed_input_shape = True
+            self._allocate((shape[0],) + self.input_shape)
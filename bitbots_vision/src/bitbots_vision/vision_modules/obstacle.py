@@ -18,15 +18,7 @@ class ObstacleDetector(CandidateFinder):
         self._white_color_detector = white_color_detector
         self._field_boundary_detector = field_boundary_detector
         self._runtime_evaluator = runtime_evaluator
-        self._color_threshold = config['obstacle_color_threshold']
-        self._white_threshold = config['obstacle_white_threshold']
-        self._field_boundary_diff_threshold = config['obstacle_field_boundary_diff_threshold']
-        self._candidate_field_boundary_offset = config['obstacle_candidate_field_boundary_offset']
-        self._candidate_min_width = config['obstacle_candidate_min_width']
-        self._candidate_max_width = config['obstacle_candidate_max_width']
-        self._finder_step_length = config['obstacle_finder_step_length']
-        self._obstacle_finder_method = config['obstacle_finder_method']
-        self._distance_value_increase = config['obstacle_finder_value_increase']
+        self.set_config(config)
 
         self._image = None
         self._blue_mask = None
@@ -39,6 +31,22 @@ class ObstacleDetector(CandidateFinder):
         self._white_obstacles = None
         self._other_obstacles = None
 
+    def set_config(self, config):
+        # type: (dict) -> None
+        """
+        updates the configuration
+        :param config: the configuration contained in visionparams.yaml
+        """
+        self._color_threshold = config['obstacle_color_threshold']
+        self._white_threshold = config['obstacle_white_threshold']
+        self._field_boundary_diff_threshold = config['obstacle_field_boundary_diff_threshold']
+        self._candidate_field_boundary_offset = config['obstacle_candidate_field_boundary_offset']
+        self._candidate_min_width = config['obstacle_candidate_min_width']
+        self._candidate_max_width = config['obstacle_candidate_max_width']
+        self._finder_step_length = config['obstacle_finder_step_length']
+        self._obstacle_finder_method = config['obstacle_finder_method']
+        self._distance_value_increase = config['obstacle_finder_value_increase']
+
     def set_image(self, image):
         self._image = image
         self._blue_mask = None
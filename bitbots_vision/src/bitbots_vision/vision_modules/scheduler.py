@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class FrameScheduler(object):
+    """
+    FrameScheduler runs the tasks of the per-frame pipeline in the order given by their dependencies.
+
+    The tasks are declared once with add_task. Each call of run processes one frame:
+    a task is started as soon as all of its dependencies are finished, independent tasks run in parallel
+    on a persistent pool of worker threads. Without workers, the tasks run one after another in the calling thread.
+    The duration of every task is measured, see get_timings.
+    """
+
+    def __init__(self, worker_count):
+        # type: (int) -> None
+        """
+        :param worker_count: number of worker threads, 0 runs all tasks in the calling thread
+        """
+        self._tasks = OrderedDict()  # name -> (function, dependencies)
+        self._timings = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=worker_count) if worker_count > 0 else None
+
+    def add_task(self, name, function, dependencies=()):
+        # type: (str, callable, tuple) -> None
+        """
+        declares a task of the pipeline
+        :param name: unique name of the task
+        :param function: function without arguments doing the work of the task
+        :param dependencies: names of the tasks, which have to be finished before this task starts
+        """
+        for dependency in dependencies:
+            if dependency not in self._tasks:
+                raise ValueError('the dependency {} of the task {} has to be added first'.format(dependency, name))
+        self._tasks[name] = (function, tuple(dependencies))
+
+    def run(self):
+        # type: () -> None
+        """
+        runs all tasks for the current frame and returns when they are finished.
+        If a task raises an exception, its dependent tasks are skipped and the exception is raised
+        after the other tasks are finished.
+        """
+        self._timings = OrderedDict()
+        start = time.time()
+        if self._executor is None:
+            for name in self._tasks:
+                self._run_task(name)
+        else:
+            self._run_parallel()
+        self._timings['total'] = time.time() - start
+
+    def _run_parallel(self):
+        remaining = OrderedDict((name, set(dependencies)) for name, (_, dependencies) in self._tasks.items())
+        running = dict()  # future -> name
+        error = None
+        while remaining or running:
+            # start every task whose dependencies are finished
+            for name in [name for name, dependencies in remaining.items() if not dependencies]:
+                del remaining[name]
+                running[self._executor.submit(self._run_task, name)] = name
+            if not running:
+                # the remaining tasks depend on a failed task
+                break
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    # skip everything depending on the failed task
+                    remaining = OrderedDict(
+                        (other, dependencies) for other, dependencies in remaining.items()
+                        if name not in self._tasks[other][1])
+                    continue
+                for dependencies in remaining.values():
+                    dependencies.discard(name)
+        if error is not None:
+            raise error
+
+    def _run_task(self, name):
+        start = time.time()
+        self._tasks[name][0]()
+        self._timings[name] = time.time() - start
+
+    def get_timings(self):
+        # type: () -> OrderedDict
+        """
+        returns the durations of the tasks of the last frame in seconds and the duration of the whole frame as 'total'
+        """
+        return self._timings
+
+    def get_timing_summary(self):
+        # type: () -> str
+        """
+        returns the durations of the last frame as a readable string
+        """
+        return ', '.join('{}: {:.1f} ms'.format(name, duration * 1000) for name, duration in self._timings.items())
+
+    def shutdown(self):
+        """
+        stops the worker threads after the current frame
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
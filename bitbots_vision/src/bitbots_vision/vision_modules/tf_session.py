@@ -0,0 +1,87 @@
+import os
+import tensorflow as tf
+import rospy
+
+# thread options of the global thread pools, which are created with the first session without per session threads
+_global_thread_options = None
+
+
+def parse_cpu_list(cpu_list):
+    # type: (str) -> set
+    """
+    Parses a list of cpus like '0,2-3' into a set of cpu ids.
+
+    :param cpu_list: comma separated cpu ids or ranges of cpu ids
+    :return: set of cpu ids, None for an empty list
+    """
+    cpus = set()
+    for part in cpu_list.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus or None
+
+
+def create_session(session_options=None, graph=None):
+    # type: (dict, tf.Graph) -> tf.Session
+    """
+    Creates a tensorflow session for the neural networks of the vision.
+
+    The session options are:
+    intra_op_threads: threads used inside of a single operation, 0 lets tensorflow choose (one per core)
+    inter_op_threads: threads running independent operations in parallel, 0 lets tensorflow choose
+    cpu_affinity: cpus the threads of tensorflow are allowed to run on, e.g. '2,3' or '2-3', empty for all cpus
+    use_per_session_threads: creates the thread pools for this session instead of sharing the global ones
+
+    The thread pools are created together with the session and inherit the cpu affinity of the creating thread.
+    Therefore the affinity is only set for the calling thread while the session is created.
+    The global thread pools are created with the first session of the process and keep its thread options.
+    Later sessions with other thread options therefore get their own thread pools, as with use_per_session_threads.
+
+    :param session_options: dict of the session options, missing options use the defaults of tensorflow
+    :param graph: graph of the session, None for the default graph
+    :return: the session
+    """
+    if session_options is None:
+        session_options = {}
+
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    config.intra_op_parallelism_threads = session_options.get('intra_op_threads', 0)
+    config.inter_op_parallelism_threads = session_options.get('inter_op_threads', 0)
+    config.use_per_session_threads = session_options.get('use_per_session_threads', False)
+
+    global _global_thread_options
+    thread_options = (
+        config.intra_op_parallelism_threads,
+        config.inter_op_parallelism_threads,
+        session_options.get('cpu_affinity', ''))
+    if not config.use_per_session_threads:
+        if _global_thread_options is None:
+            _global_thread_options = thread_options
+        elif _global_thread_options != thread_options:
+            rospy.loginfo("The global tensorflow thread pools use other options, the session gets its own thread pools.")
+            config.use_per_session_threads = True
+
+    cpus = parse_cpu_list(session_options.get('cpu_affinity', ''))
+    if cpus is None:
+        return tf.Session(graph=graph, config=config)
+    if not hasattr(os, 'sched_setaffinity'):
+        rospy.logwarn("Setting the cpu affinity of tensorflow is not supported by this python version.")
+        return tf.Session(graph=graph, config=config)
+
+    # pid 0 is the calling thread
+    previous_cpus = os.sched_getaffinity(0)
+    try:
+        os.sched_setaffinity(0, cpus)
+    except (OSError, ValueError) as e:
+        rospy.logwarn("Could not set the cpu affinity of tensorflow to {}: {}".format(sorted(cpus), e))
+        return tf.Session(graph=graph, config=config)
+    try:
+        return tf.Session(graph=graph, config=config)
+    finally:
+        os.sched_setaffinity(0, previous_cpus)
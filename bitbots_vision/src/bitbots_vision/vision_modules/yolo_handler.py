@@ -9,11 +9,55 @@ except:
     rospy.logerr("Not able to run YOLO! Its only executable under python3 with yolo34py or yolo34py-gpu installed.")
 import numpy as np
 from .candidate import CandidateFinder, Candidate
+from .frame_cache import FrameCache
 
 # todo implement candidate finder
 
+
+def non_maximum_suppression(boxes, scores, iou_threshold):
+    # type: (np.array, np.array, float) -> np.array
+    """
+    removes boxes overlapping a higher rated box by more than the threshold (greedy, vectorized over all boxes)
+    :param boxes: np.array of shape (n, 4) containing x1, y1, x2, y2
+    :param scores: np.array of the n ratings
+    :param iou_threshold: maximal intersection over union of two kept boxes
+    :return: indices of the kept boxes, the best rated first
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    order = np.argsort(scores)[::-1]
+    keep = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(best)
+        others = order[1:]
+        width = np.clip(np.minimum(x2[best], x2[others]) - np.maximum(x1[best], x1[others]), 0, None)
+        height = np.clip(np.minimum(y2[best], y2[others]) - np.maximum(y1[best], y1[others]), 0, None)
+        intersection = width * height
+        iou = intersection / np.maximum(areas[best] + areas[others] - intersection, 1e-9)
+        order = others[iou <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+
 class YoloHandler():
-    def __init__(self, config, model_path):
+    """
+    Runs yolo on the image and provides the ball and goalpost candidates.
+
+    Inference modes:
+    full: the whole image
+    below_boundary: only the region below the highest point of the field boundary
+    tiled: the region below the field boundary split into overlapping tiles,
+        each tile is processed in the full network resolution, which helps with small balls far away.
+        The detections of the tiles are merged with a non-maximum suppression.
+    """
+
+    def __init__(self, config, model_path, frame_cache=None, field_boundary_detector=None):
+        """
+        :param config: vision config
+        :param model_path: path of the yolo model folder
+        :param frame_cache: FrameCache shared with other modules, a private one is created if None
+        :param field_boundary_detector: used by the inference modes below_boundary and tiled
+        """
         weightpath = os.path.join(model_path, "yolo_weights.weights")
         configpath = os.path.join(model_path, "config.cfg")
         datapath = os.path.join("/tmp/obj.data")
@@ -21,65 +65,115 @@ class YoloHandler():
 
         self._generate_dummy_obj_data_file(namepath)
 
-        self.config = config
+        self.set_config(config, field_boundary_detector)
 
         self.net = Detector(bytes(configpath, encoding="utf-8"), bytes(weightpath, encoding="utf-8"), 0.5,
                        bytes(datapath, encoding="utf-8"))
         self.classes = ["ball", "goalpost"]
         self.image = None
-        self.results = None
-        self.goalpost_candidates = None
-        self.ball_candidates = None
+        self._frame_cache = frame_cache if frame_cache is not None else FrameCache()
 
     def _generate_dummy_obj_data_file(self, obj_name_path):
         obj_data = "classes = 2\nnames = " + obj_name_path
         with open('/tmp/obj.data', 'w') as f:
             f.write(obj_data)
 
-    def set_image(self, img):
-        if np.array_equal(img,self.image):
-            return
-        self.image = img
-        self.results =  None
+    def set_config(self, config, field_boundary_detector=None):
+        self.config = config
+        self._field_boundary_detector = field_boundary_detector
+        self._inference_mode = config['yolo_inference_mode']
+        self._crop_margin = config['yolo_crop_margin']
+        self._tile_count = config['yolo_tile_count']
+        self._tile_overlap = config['yolo_tile_overlap']
+        self._nms_threshold = config['yolo_nms_threshold']
+
+    def set_image(self, img, frame_id=None):
+        """
+        sets the image to work on. The detectors sharing this handler may set the same frame multiple times.
+        :param img: the current image
+        :param frame_id: id of the frame, e.g. the header stamp of the image.
+            Without an id, the frames are distinguished by the identity of the image object.
+        """
+        if frame_id is None:
+            # the handler holds a reference of the current image, so no other image can have its id
+            frame_id = id(img)
         self.image = img
-        self.goalpost_candidates = None
-        self.ball_candidates = None
-
+        self._frame_cache.set_frame(frame_id)
 
     def predict(self):
-        if self.results is None:
-            self.results = self.net.detect(Image(self.image))
-            class_ids = []
-            confidences = []
-            boxes = []
-            self.ball_candidates = []
-            self.goalpost_candidates = []
-            for out in self.results:
+        """
+        runs yolo on the current image, once per frame
+        :return: the ball and the goalpost candidates
+        """
+        return self._frame_cache.get('yolo_candidates', self._detect)
+
+    def _detect(self):
+        regions = self._get_regions()
+        class_ids = []
+        confidences = []
+        boxes = []
+        for rx1, ry1, rx2, ry2 in regions:
+            region = self.image if len(regions) == 1 and (rx1, ry1) == (0, 0) \
+                else np.ascontiguousarray(self.image[ry1:ry2, rx1:rx2])
+            for out in self.net.detect(Image(region)):
                 print("********{}********".format(out[0]))
-                class_id = out[0]
-                confidence = out[1]
                 x, y, w, h = out[2]
-                x = x - int(w // 2)
-                y = y - int(h // 2)
-                c = Candidate(int(x), int(y), int(w), int(h))
-                c.rating = confidence
-                class_id = class_id
-                if class_id == b"ball":
-                    self.ball_candidates.append(c)
-                if class_id == b"goalpost":
-                    self.goalpost_candidates.append(c)
+                class_ids.append(out[0])
+                confidences.append(out[1])
+                boxes.append((x - w / 2.0 + rx1, y - h / 2.0 + ry1, x + w / 2.0 + rx1, y + h / 2.0 + ry1))
+
+        keep = range(len(boxes))
+        if len(regions) > 1 and boxes:
+            # shift the boxes of each class apart, so one suppression handles all classes separately
+            # boxes at the image border can have negative coordinates, so the shift is the full coordinate span
+            boxes_array = np.array(boxes)
+            classes = sorted(set(class_ids))
+            span = boxes_array.max() - boxes_array.min() + 1
+            offsets = np.array([classes.index(class_id) for class_id in class_ids]) * span
+            keep = non_maximum_suppression(boxes_array + offsets[:, None], np.array(confidences), self._nms_threshold)
+
+        ball_candidates = []
+        goalpost_candidates = []
+        for i in keep:
+            x1, y1, x2, y2 = boxes[i]
+            c = Candidate(int(x1), int(y1), int(x2 - x1), int(y2 - y1))
+            c.rating = confidences[i]
+            if class_ids[i] == b"ball":
+                ball_candidates.append(c)
+            if class_ids[i] == b"goalpost":
+                goalpost_candidates.append(c)
+        return ball_candidates, goalpost_candidates
+
+    def _get_regions(self):
+        # type: () -> list
+        """
+        returns the image regions yolo runs on in the configured inference mode
+        :return: list of (x1, y1, x2, y2)
+        """
+        height, width = self.image.shape[:2]
+        if self._inference_mode == 'full' or self._field_boundary_detector is None:
+            return [(0, 0, width, height)]
+        # the network needs a few rows to work on
+        top = min(self._field_boundary_detector.get_upper_bound(y_offset=self._crop_margin), height - 16)
+        if self._inference_mode != 'tiled' or self._tile_count <= 1:
+            return [(0, top, width, height)]
+        # tiles of equal width, neighbours overlap by the tile_overlap fraction of the tile width
+        tile_width = width / (self._tile_count - (self._tile_count - 1) * self._tile_overlap)
+        step = tile_width * (1 - self._tile_overlap)
+        return [(int(i * step), top, min(width, int(round(i * step + tile_width))), height)
+                for i in range(self._tile_count)]
 
     def get_candidates(self):
-        self.predict()
-        return [self.ball_candidates, self.goalpost_candidates]
+        ball_candidates, goalpost_candidates = self.predict()
+        return [ball_candidates, goalpost_candidates]
 
 class YoloBallDetector(CandidateFinder):
 
     def __init__(self, yolo):
         self.yolo = yolo
 
-    def set_image(self, image):
-        self.yolo.set_image(image)
+    def set_image(self, image, stamp=None):
+        self.yolo.set_image(image, stamp)
 
     def get_candidates(self):
         return self.yolo.get_candidates()[0]
@@ -97,8 +191,8 @@ class YoloGoalpostDetector(CandidateFinder):
     def __init__(self, yolo):
         self.yolo = yolo
 
-    def set_image(self, image):
-        self.yolo.set_image(image)
+    def set_image(self, image, stamp=None):
+        self.yolo.set_image(image, stamp)
 
     def get_candidates(self):
         return self.yolo.get_candidates()[1]
@@ -5,6 +5,7 @@ from geometry_msgs.msg import Point
 from sensor_msgs.msg import Image
 import numpy as np
 from cv_bridge import CvBridge
+from bitbots_vision.vision_modules import image_decoding
 import cv2
 
 
@@ -29,7 +30,7 @@ class Converter(object):
         rospy.spin()
 
     def _callback_fcnn(self, msg):
-        input_image = self.bridge.imgmsg_to_cv2(msg.image, 'bgr8')  # TODO: evaluate this!!!
+        input_image = image_decoding.imgmsg_to_bgr(msg.image)  # TODO: evaluate this!!!
         rospy.logdebug(input_image.shape)
         rospy.logdebug((int(msg.regionOfInterest.width) + 1, int(msg.regionOfInterest.height) + 1))
         input_image = cv2.resize(input_image, (int(msg.regionOfInterest.width) + 1, int(msg.regionOfInterest.height) + 1))
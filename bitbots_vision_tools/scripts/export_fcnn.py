@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+from bitbots_vision.vision_modules.live_fcnn_03 import FCNN03, FROZEN_GRAPH_FILE
+from bitbots_vision.vision_modules.debug import DebugPrinter
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Exports a FCNN03 model as frozen graph for the 'frozen' ball_fcnn_backend.")
+    parser.add_argument("-m", "--model", required=True, help="Path to the fcnn model folder.")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Path of the exported graph. Defaults to {} in the model folder.".format(FROZEN_GRAPH_FILE))
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.model):
+        print("Model path incorrect!")
+    else:
+        output_path = args.output or os.path.join(args.model, FROZEN_GRAPH_FILE)
+        fcnn = FCNN03(args.model, DebugPrinter(debug_classes=[]), use_dropout=False)
+        fcnn.export_frozen_graph(output_path)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import time
+import cv2
+import numpy as np
+from bitbots_vision.vision_modules.live_fcnn_03 import FCNN03
+from bitbots_vision.vision_modules.fcnn_handler import FcnnHandler
+from bitbots_vision.vision_modules.debug import DebugPrinter
+
+
+def load_heatmaps(model_path, image_path, batch_size=1):
+    """
+    Runs the fcnn on every image in the given folder and returns the binarized outputs.
+    The binarization is the same as in the FcnnHandler.
+    """
+    fcnn = FCNN03(model_path, DebugPrinter(debug_classes=[]))
+    in_imgs = []
+    for image_name in sorted(os.listdir(image_path)):
+        image = cv2.imread(os.path.join(image_path, image_name))
+        if image is None:
+            continue
+        in_img = cv2.resize(image, (fcnn.input_shape[1], fcnn.input_shape[0]))
+        in_imgs.append(cv2.cvtColor(in_img, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0)
+    binary_heatmaps = []
+    for start in range(0, len(in_imgs), batch_size):
+        for out in fcnn.predict(in_imgs[start:start + batch_size]):
+            heatmap = (out.reshape(out.shape[0], out.shape[1]) * 255).astype(np.uint8)
+            r, out_bin = cv2.threshold(heatmap, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            binary_heatmaps.append(out_bin)
+    print("Loaded {} images".format(len(binary_heatmaps)))
+    return binary_heatmaps
+
+
+def box_quality(binary_heatmap, boxes):
+    """
+    Returns quality measures of the boxes found in a binary heatmap:
+    coverage: fraction of the activated pixels that are inside of a box
+    fill: mean fraction of activated pixels inside of the boxes
+    duplicates: fraction of boxes, that overlap another box by more than half of their area
+    """
+    activated = binary_heatmap > 0
+    covered = np.zeros_like(activated)
+    fills = []
+    for x1, y1, x2, y2 in boxes:
+        covered[y1:y2, x1:x2] = True
+        area = max(1, (x2 - x1) * (y2 - y1))
+        fills.append(np.count_nonzero(activated[y1:y2, x1:x2]) / float(area))
+    coverage = np.count_nonzero(activated & covered) / float(max(1, np.count_nonzero(activated)))
+    duplicates = 0
+    for i, (x1, y1, x2, y2) in enumerate(boxes):
+        area = max(1, (x2 - x1) * (y2 - y1))
+        for j, other in enumerate(boxes):
+            if i == j:
+                continue
+            overlap_x = max(0, min(x2, other[2]) - max(x1, other[0]))
+            overlap_y = max(0, min(y2, other[3]) - max(y1, other[1]))
+            if overlap_x * overlap_y > area / 2.0:
+                duplicates += 1
+                break
+    return coverage, np.mean(fills) if fills else 1.0, duplicates / float(max(1, len(boxes)))
+
+
+def run(binary_heatmaps, methods, repetitions):
+    for name, method in methods:
+        start = time.time()
+        for _ in range(repetitions):
+            results = [method(binary_heatmap) for binary_heatmap in binary_heatmaps]
+        duration = (time.time() - start) / float(repetitions * len(binary_heatmaps))
+        quality = np.array([box_quality(binary_heatmap, boxes) for binary_heatmap, boxes in zip(binary_heatmaps, results)])
+        print("{}:".format(name))
+        print("    time per heatmap: {:.3f} ms".format(duration * 1000))
+        print("    boxes per heatmap: {:.2f}".format(np.mean([len(boxes) for boxes in results])))
+        print("    coverage of activated pixels: {:.3f}".format(quality[:, 0].mean()))
+        print("    fill of boxes: {:.3f}".format(quality[:, 1].mean()))
+        print("    duplicate boxes: {:.3f}".format(quality[:, 2].mean()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the candidate extraction methods of the FcnnHandler in speed and box quality.")
+    parser.add_argument("-m", "--model", required=True, help="Path to the fcnn model folder.")
+    parser.add_argument("-i", "--images", required=True, help="Folder containing the images.")
+    parser.add_argument("-r", "--repetitions", type=int, default=10, help="Repetitions of the time measurement.")
+    parser.add_argument("-b", "--batch-size", type=int, default=8, help="Images per run of the fcnn.")
+    parser.add_argument("--pointcloud-stepsize", type=int, default=3, help="findSpots grid distance in heatmap pixels.")
+    parser.add_argument("--expand-stepsize", type=int, default=1, help="findSpots expansion step in heatmap pixels.")
+    parser.add_argument("--refinement-iterations", type=int, default=1, help="findSpots refinement iterations.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.images):
+        print("Image folder incorrect!")
+    elif not os.path.isdir(args.model):
+        print("Model path incorrect!")
+    else:
+        heatmaps = load_heatmaps(args.model, args.images, max(1, args.batch_size))
+        run(heatmaps, [
+            ("findspots", lambda binary_heatmap: FcnnHandler.find_boxes_spots(
+                binary_heatmap,
+                args.pointcloud_stepsize,
+                args.expand_stepsize,
+                args.refinement_iterations)),
+            ("components", FcnnHandler.find_boxes_components)],
+            args.repetitions)
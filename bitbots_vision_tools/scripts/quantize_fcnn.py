@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import time
+import cv2
+import numpy as np
+import tensorflow as tf
+from bitbots_vision.vision_modules.live_fcnn_03 import FCNN03, FrozenFCNN03, QuantizedFCNN03, FROZEN_GRAPH_FILE
+from bitbots_vision.vision_modules.fcnn_handler import FcnnHandler
+from bitbots_vision.vision_modules.debug import DebugPrinter
+
+
+def load_images(image_path, input_shape, limit=None):
+    """
+    Loads the images of a folder and preprocesses them like the FcnnHandler does for a full image.
+    """
+    images = []
+    for image_name in sorted(os.listdir(image_path)):
+        image = cv2.imread(os.path.join(image_path, image_name))
+        if image is None:
+            continue
+        in_img = cv2.resize(image, (input_shape[1], input_shape[0]))
+        images.append(cv2.cvtColor(in_img, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0)
+        if limit is not None and len(images) >= limit:
+            break
+    print("Loaded {} images from '{}'".format(len(images), image_path))
+    return images
+
+
+def binarize(heatmap):
+    heatmap = (heatmap.reshape(heatmap.shape[0], heatmap.shape[1]) * 255).astype(np.uint8)
+    r, out_bin = cv2.threshold(heatmap, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return out_bin
+
+
+def run_model(fcnn, images, repetitions):
+    """
+    Returns the heatmaps of the model and its inference times per image in seconds.
+    """
+    fcnn.predict([images[0]])  # warm up
+    durations = []
+    for _ in range(repetitions):
+        heatmaps = []
+        for image in images:
+            start = time.time()
+            heatmaps.append(fcnn.predict([image])[0])
+            durations.append(time.time() - start)
+    return heatmaps, np.array(durations)
+
+
+def compare(reference_heatmaps, heatmaps):
+    """
+    Returns accuracy measures of the heatmaps compared to the heatmaps of the float model:
+    mean absolute difference of the heatmaps,
+    intersection over union of the binarized heatmaps,
+    recall: fraction of the reference candidate boxes whose center is inside of a candidate box.
+    """
+    differences = []
+    ious = []
+    found = 0
+    total = 0
+    for reference, heatmap in zip(reference_heatmaps, heatmaps):
+        differences.append(np.mean(np.abs(reference.astype(np.float32) - heatmap.astype(np.float32))))
+        reference_bin = binarize(reference) > 0
+        heatmap_bin = binarize(heatmap) > 0
+        union = np.count_nonzero(reference_bin | heatmap_bin)
+        ious.append(np.count_nonzero(reference_bin & heatmap_bin) / float(union) if union else 1.0)
+        boxes = FcnnHandler.find_boxes_components(heatmap_bin.astype(np.uint8) * 255)
+        for x1, y1, x2, y2 in FcnnHandler.find_boxes_components(reference_bin.astype(np.uint8) * 255):
+            total += 1
+            center_x, center_y = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+            if any(bx1 <= center_x <= bx2 and by1 <= center_y <= by2 for bx1, by1, bx2, by2 in boxes):
+                found += 1
+    return np.mean(differences), np.mean(ious), found / float(max(1, total))
+
+
+def report(name, durations, accuracy=None):
+    print("{}:".format(name))
+    print("    time per image: mean {:.2f} ms, median {:.2f} ms, 95th percentile {:.2f} ms".format(
+        durations.mean() * 1000, np.median(durations) * 1000, np.percentile(durations, 95) * 1000))
+    if accuracy is not None:
+        print("    mean absolute heatmap difference: {:.4f}".format(accuracy[0]))
+        print("    iou of binarized heatmaps: {:.3f}".format(accuracy[1]))
+        print("    candidate recall: {:.3f}".format(accuracy[2]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Quantizes a FCNN03 model to int8 for the 'quantized' ball_fcnn_backend "
+                    "and compares the quantized model to the float model in accuracy and speed. "
+                    "The model folder has to contain the frozen graph, see export_fcnn.py.")
+    parser.add_argument("-m", "--model", required=True, help="Path to the fcnn model folder.")
+    parser.add_argument("-c", "--calibration-images", required=True, help="Folder containing the calibration images.")
+    parser.add_argument("-e", "--evaluation-images", default=None,
+                        help="Folder containing the images for the comparison. Defaults to the calibration images.")
+    parser.add_argument("-n", "--calibration-count", type=int, default=200, help="Maximal number of calibration images.")
+    parser.add_argument("-r", "--repetitions", type=int, default=3, help="Repetitions of the time measurement.")
+    parser.add_argument("--skip-conversion", action="store_true", help="Only compare an already quantized model.")
+    args = parser.parse_args()
+
+    evaluation_path = args.evaluation_images or args.calibration_images
+    if not os.path.isdir(args.model):
+        print("Model path incorrect!")
+    elif not os.path.isfile(os.path.join(args.model, FROZEN_GRAPH_FILE)):
+        print("Frozen graph is missing, run export_fcnn.py first!")
+    elif not os.path.isdir(args.calibration_images) or not os.path.isdir(evaluation_path):
+        print("Image folder incorrect!")
+    else:
+        debug_printer = DebugPrinter(debug_classes=[])
+        with tf.Graph().as_default():
+            float_fcnn = FCNN03(args.model, debug_printer)
+        input_shape = float_fcnn.input_shape
+
+        if not args.skip_conversion:
+            calibration_images = load_images(args.calibration_images, input_shape, args.calibration_count)
+            output_path = QuantizedFCNN03.convert(args.model, calibration_images, input_shape)
+            print("Wrote quantized model to '{}'".format(output_path))
+
+        images = load_images(evaluation_path, input_shape)
+        reference_heatmaps, durations = run_model(float_fcnn, images, args.repetitions)
+        report("tensorflow (float32)", durations)
+        for name, fcnn in [
+                ("frozen (float32)", FrozenFCNN03(args.model, debug_printer)),
+                ("quantized (int8)", QuantizedFCNN03(args.model, debug_printer))]:
+            heatmaps, durations = run_model(fcnn, images, args.repetitions)
+            report(name, durations, compare(reference_heatmaps, heatmaps))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import itertools
+import threading
+import cv2
+import numpy as np
+import rospy
+from cv_bridge import CvBridge
+from dynamic_reconfigure.client import Client
+from sensor_msgs.msg import Image
+from humanoid_league_msgs.msg import LineInformationInImage
+
+
+class VisionBenchmark:
+    """
+    Sends recorded images to a running vision one after another and measures the time
+    until the vision published the line message of the image, which is the end of the processing of a frame.
+    The tensorflow session settings are changed with dynamic reconfigure between the runs.
+    """
+
+    def __init__(self, image_path, timeout):
+        self._bridge = CvBridge()
+        self._timeout = timeout
+        self._images = []
+        for image_name in sorted(os.listdir(image_path)):
+            image = cv2.imread(os.path.join(image_path, image_name))
+            if image is not None:
+                self._images.append(image)
+        print("Loaded {} images".format(len(self._images)))
+
+        self._received = threading.Event()
+        self._expected_stamp = None
+        self._client = Client("bitbots_vision", timeout=30)
+        config = self._client.get_configuration()
+        self._pub_image = rospy.Publisher(config['ROS_img_msg_topic'], Image, queue_size=1)
+        self._sub_lines = rospy.Subscriber(
+            config['ROS_line_msg_topic'], LineInformationInImage, self._line_callback, queue_size=1, tcp_nodelay=True)
+        rospy.sleep(1.0)  # wait for the connections
+
+    def _line_callback(self, msg):
+        if msg.header.stamp == self._expected_stamp:
+            self._received.set()
+
+    def measure(self, settings, frames, warmup):
+        """
+        Applies the settings and returns the frame times in seconds. Frames the vision skipped are left out.
+        """
+        self._client.update_configuration(settings)
+        durations = []
+        for i in range(warmup + frames):
+            msg = self._bridge.cv2_to_imgmsg(self._images[i % len(self._images)], "bgr8")
+            msg.header.frame_id = "/camera_link"
+            msg.header.stamp = rospy.get_rostime()
+            self._expected_stamp = msg.header.stamp
+            self._received.clear()
+            start = rospy.get_rostime()
+            self._pub_image.publish(msg)
+            if self._received.wait(self._timeout) and i >= warmup:
+                durations.append((rospy.get_rostime() - start).to_sec())
+        return np.array(durations)
+
+
+def parse_values(values, type=int):
+    return [type(value) for value in values.split(";")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweeps the tensorflow session settings of a running vision on recorded images "
+                    "and reports the time per vision frame.")
+    parser.add_argument("-i", "--images", required=True, help="Folder containing the images.")
+    parser.add_argument("-n", "--frames", type=int, default=100, help="Measured frames per setting.")
+    parser.add_argument("-w", "--warmup", type=int, default=10, help="Frames before the measurement per setting.")
+    parser.add_argument("-t", "--timeout", type=float, default=2.0, help="Seconds to wait for the result of a frame.")
+    parser.add_argument("--intra-op-threads", default="0;1;2;4", help="Semicolon separated values to test.")
+    parser.add_argument("--inter-op-threads", default="0;1;2", help="Semicolon separated values to test.")
+    parser.add_argument("--cpu-affinity", default="", help="Semicolon separated cpu lists to test, e.g. ';2,3'.")
+    # the global thread pools of tensorflow keep the options of the first session,
+    # the vision only applies other options with per session thread pools
+    parser.add_argument("--per-session-threads", default="1", help="Semicolon separated values (0 or 1) to test.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.images):
+        print("Image folder incorrect!")
+    else:
+        rospy.init_node("bitbots_vision_benchmark")
+        benchmark = VisionBenchmark(args.images, args.timeout)
+        results = []
+        for intra, inter, affinity, per_session in itertools.product(
+                parse_values(args.intra_op_threads),
+                parse_values(args.inter_op_threads),
+                parse_values(args.cpu_affinity, str),
+                parse_values(args.per_session_threads)):
+            settings = {
+                'neural_network_intra_op_threads': intra,
+                'neural_network_inter_op_threads': inter,
+                'neural_network_cpu_affinity': affinity,
+                'neural_network_use_per_session_threads': bool(per_session)}
+            durations = benchmark.measure(settings, args.frames, args.warmup)
+            if rospy.is_shutdown():
+                break
+            name = "intra {} inter {} affinity '{}' per session {}".format(intra, inter, affinity, bool(per_session))
+            if len(durations) == 0:
+                print("{}: no frames received".format(name))
+                continue
+            print("{}: mean {:.2f} ms, median {:.2f} ms, 95th percentile {:.2f} ms, {} of {} frames".format(
+                name, durations.mean() * 1000, np.median(durations) * 1000,
+                np.percentile(durations, 95) * 1000, len(durations), args.frames))
+            results.append((durations.mean(), name))
+        if results:
+            print("fastest: {}".format(min(results)[1]))
@@ -1,7 +1,7 @@
 #! /usr/bin/env python2
 from dynamic_reconfigure.server import Server
 from bitbots_vision_tools.cfg import ColorTestConfig
-from bitbots_vision.vision_modules import color, debug
+from bitbots_vision.vision_modules import color, debug, image_decoding
 from sensor_msgs.msg import Image
 from cv_bridge import CvBridge
 import rospy
@@ -32,7 +32,7 @@ class ColorTest:
 
     def handle_image(self, image_msg):
         # converting the ROS image message to CV2-image
-        image = self.bridge.imgmsg_to_cv2(image_msg, "bgr8")
+        image = image_decoding.imgmsg_to_bgr(image_msg)
 
         # mask image
         mask_img = self.color_detector.mask_image(image)